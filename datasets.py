@@ -10,47 +10,340 @@ import torch
 from torch.utils import data
 
 import pickle
+import glob
+import collections
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.dataset_cache import DecodedCache
+from utils.tar_shards import list_shards, read_shard
+from utils.manifest import get_manifest, get_label_file, get_trainId_label_path
+
+def get_random_scale():
+    return 0.5 + random.randint(0, 16)/10.0
 
 def generate_scale_label(image, label):
-    f_scale = 0.5 + random.randint(0, 16)/10.0
+    f_scale = get_random_scale()
     image = cv2.resize(image, None, fx=f_scale, fy=f_scale, interpolation=cv2.INTER_LINEAR)
     label = cv2.resize(label, None, fx=f_scale, fy=f_scale, interpolation=cv2.INTER_NEAREST)
     return image, label
 
-def id2trainId(label, id_to_trainid):
-    label_copy = label.copy()
+def get_linear_coords(dst_start, dst_len, scale, src_len):
+    # (source pixels and weights of dst pixels dst_start, ..., dst_start+dst_len-1
+    # when resizing with cv2.INTER_LINEAR, scale = src size/dst size)
+    x = (np.arange(dst_start, dst_start + dst_len) + 0.5)*scale - 0.5
+    x0 = np.floor(x).astype(np.int64)
+    w1 = (x - x0).astype(np.float32)
+    w1[x0 < 0] = 0
+    x0[x0 < 0] = 0
+    w1[x0 >= src_len - 1] = 0
+    x0[x0 >= src_len - 1] = src_len - 1
+    x1 = np.minimum(x0 + 1, src_len - 1)
+    return x0, x1, w1
+
+def get_nearest_coords(dst_start, dst_len, scale, src_len):
+    # (source pixels of dst pixels dst_start, ..., dst_start+dst_len-1 when resizing with cv2.INTER_NEAREST)
+    x = np.floor(np.arange(dst_start, dst_start + dst_len)*scale).astype(np.int64)
+    return np.minimum(x, src_len - 1)
+
+def resize_crop(image, label, f_scale, h_off, w_off, crop_h, crop_w):
+    # (computes the crop [h_off:h_off+crop_h, w_off:w_off+crop_w] of
+    # cv2.resize(image/label, None, fx=f_scale, fy=f_scale) from the source
+    # pixels inside the crop only, image with INTER_LINEAR, label with INTER_NEAREST.
+    # The image may have been decoded at a reduced resolution, f_scale is
+    # relative to the (full resolution) label)
+    src_h, src_w = label.shape
+    scale = 1.0/f_scale
+
+    y0, y1, wy = get_linear_coords(h_off, crop_h, scale*image.shape[0]/src_h, image.shape[0])
+    x0, x1, wx = get_linear_coords(w_off, crop_w, scale*image.shape[1]/src_w, image.shape[1])
+    wy = wy[:, np.newaxis, np.newaxis]
+    wx = wx[np.newaxis, :, np.newaxis]
+    # (separable: first interpolate between the rows, only for the columns that are needed)
+    x_min = x0[0]
+    x_max = x1[-1] + 1
+    image_rows = (1 - wy)*image[y0, x_min:x_max] + wy*image[y1, x_min:x_max]
+    image_crop = (1 - wx)*image_rows[:, x0 - x_min] + wx*image_rows[:, x1 - x_min]
+    image_crop = np.rint(image_crop) # (cv2.resize of the uint8 image rounds)
+
+    y = get_nearest_coords(h_off, crop_h, scale, src_h)
+    x = get_nearest_coords(w_off, crop_w, scale, src_w)
+    label_crop = label[y[:, np.newaxis], x[np.newaxis, :]]
+
+    return image_crop, label_crop
+
+def augment_example(image, label, crop_size, ignore_label, f_scale=None, uint8_output=False):
+    # (random scale, random crop (with padding) and random flip, shared by all augmentation datasets.
+    # Same distribution as generate_scale_label() followed by padding and cropping the scaled
+    # image, but the scale and crop are sampled first and only the crop is resized.
+    # f_scale is sampled here unless the caller already did (to choose a decoding reduction).
+    # With uint8_output, the image is returned as uint8 (crop_h, crop_w, 3) (BGR) and the
+    # label as uint8, to be normalized batch-wise by BatchNormalize)
+    crop_h, crop_w = crop_size
+    if f_scale is None:
+        f_scale = get_random_scale()
+
+    # (size of the scaled image, as in cv2.resize(image, None, fx=f_scale, fy=f_scale):)
+    img_h = int(round(label.shape[0]*f_scale))
+    img_w = int(round(label.shape[1]*f_scale))
+
+    # (the scaled image is padded at the bottom/right if it is smaller than the crop:)
+    h_off = random.randint(0, max(img_h, crop_h) - crop_h)
+    w_off = random.randint(0, max(img_w, crop_w) - crop_w)
+    h = min(crop_h, img_h - h_off)
+    w = min(crop_w, img_w - w_off)
+    image_crop, label_crop = resize_crop(image, label, f_scale, h_off, w_off, h, w)
+
+    if uint8_output:
+        # (padded with the mean, which BatchNormalize maps to ~0 (|x| <= 0.5) instead of exactly 0:)
+        image = np.empty((crop_h, crop_w, 3), dtype=np.uint8)
+        image[:] = np.rint(img_mean[::-1]).astype(np.uint8)
+        image[0:h, 0:w] = image_crop
+        label = np.full((crop_h, crop_w), ignore_label, dtype=np.uint8)
+        label[0:h, 0:w] = label_crop
+
+        if np.random.choice(2) == 0:
+            image = image[:, ::-1]
+            label = label[:, ::-1]
+
+        return np.ascontiguousarray(image), np.ascontiguousarray(label)
+
+    mean = (102.9801, 115.9465, 122.7717)
+    image = np.zeros((crop_h, crop_w, 3), dtype=np.float32)
+    image[0:h, 0:w] = image_crop[:,:,::-1]
+    image[0:h, 0:w] -= mean
+    label = np.full((crop_h, crop_w), ignore_label, dtype=np.float32)
+    label[0:h, 0:w] = label_crop
+    image = image.transpose((2, 0, 1))
+
+    flip = np.random.choice(2)*2 - 1
+    image = image[:, :, ::flip]
+    label = label[:, ::flip]
+
+    return image.copy(), label.copy()
+
+img_mean = np.array([102.9801, 115.9465, 122.7717], dtype=np.float32) # (RGB order)
+
+class BatchNormalize(object):
+    """
+    Normalizes a collated batch of uint8 images (from the datasets with
+    uint8_output=True) like the datasets do per example (BGR -> RGB, mean
+    subtracted, (3, h, w)), with a few vectorized ops over the whole batch on
+    the device of the batch, into a float32 buffer that is reused between
+    calls (the returned tensor is overwritten by the next call).
+    """
+    def __init__(self, mean=img_mean):
+        self.mean = torch.tensor(np.asarray(mean, dtype=np.float32)).view(1, 3, 1, 1)
+        self.buffer = None
+
+    def __call__(self, images):
+        """
+        :param images: uint8 tensor of shape (batch_size, h, w, 3) (BGR)
+        :return: float32 tensor of shape (batch_size, 3, h, w) (RGB, mean subtracted)
+        """
+        batch_size, h, w, _ = images.shape
+        if (self.buffer is None or self.buffer.device != images.device or self.buffer.shape[0] < batch_size
+                or self.buffer.shape[2:] != (h, w)):
+            self.buffer = torch.empty((batch_size, 3, h, w), dtype=torch.float32, device=images.device)
+            self.mean = self.mean.to(images.device)
+        buffer = self.buffer[0:batch_size]
+
+        for c in range(3):
+            buffer[:, c].copy_(images[:, :, :, 2 - c]) # (uint8 -> float32, BGR -> RGB)
+        buffer.sub_(self.mean)
+
+        return buffer
+
+class BatchAugment(object):
+    """
+    Random scale, random crop (with padding) and random flip of a collated
+    batch of full resolution uint8 examples (from the augmentation datasets
+    with batch_augment=True). Same distribution (and same resize semantics) as
+    augment_example(), but the crops of the whole batch are computed with a
+    few torch gathers, on any device and using the intra-op threads of torch
+    instead of DataLoader workers. The parameters of each example are drawn
+    from a generator seeded with seed.
+    """
+    def __init__(self, crop_size=(512, 512), ignore_label=255, seed=0):
+        self.crop_h, self.crop_w = crop_size
+        self.ignore_label = ignore_label
+        self.rng = random.Random(seed)
+        self.pad_value = torch.from_numpy(np.rint(img_mean[::-1]).astype(np.uint8)) # (BGR, as in augment_example())
+
+    def get_coords(self, src_h, src_w):
+        # (samples the parameters of one example, returns the source pixels/weights
+        # of the crop pixels and the padded crop rows/columns)
+        f_scale = 0.5 + self.rng.randint(0, 16)/10.0
+        img_h = int(round(src_h*f_scale))
+        img_w = int(round(src_w*f_scale))
+        h_off = self.rng.randint(0, max(img_h, self.crop_h) - self.crop_h)
+        w_off = self.rng.randint(0, max(img_w, self.crop_w) - self.crop_w)
+        flip = self.rng.randint(0, 1) == 0
+
+        y0, y1, wy = get_linear_coords(h_off, self.crop_h, 1.0/f_scale, src_h)
+        x0, x1, wx = get_linear_coords(w_off, self.crop_w, 1.0/f_scale, src_w)
+        y = get_nearest_coords(h_off, self.crop_h, 1.0/f_scale, src_h)
+        x = get_nearest_coords(w_off, self.crop_w, 1.0/f_scale, src_w)
+        # (the scaled image is padded at the bottom/right (left if flipped) if it is smaller than the crop:)
+        pad_y = slice(min(self.crop_h, img_h - h_off), self.crop_h)
+        pad_x = slice(min(self.crop_w, img_w - w_off), self.crop_w)
+        if flip:
+            x0, x1, wx, x = x0[::-1], x1[::-1], wx[::-1], x[::-1]
+            pad_x = slice(0, self.crop_w - pad_x.start)
+
+        return (y0, y1, wy, y), (x0, x1, wx, x), (pad_y, pad_x)
+
+    def __call__(self, images, labels):
+        """
+        :param images: uint8 tensor of shape (batch_size, h, w, 3) (BGR)
+        :param labels: uint8 tensor of shape (batch_size, h, w)
+        :return: images (uint8 tensor of shape (batch_size, crop_h, crop_w, 3)), labels (uint8 tensor of shape (batch_size, crop_h, crop_w))
+        """
+        batch_size, src_h, src_w = labels.shape
+        coords = [self.get_coords(src_h, src_w) for i in range(batch_size)]
+        def stack(axis, j, dtype):
+            return torch.from_numpy(np.stack([c[axis][j] for c in coords]).astype(dtype)).to(images.device)
+        y0, y1, wy, y = [stack(0, j, dtype) for j, dtype in enumerate([np.int64, np.int64, np.float32, np.int64])]
+        x0, x1, wx, x = [stack(1, j, dtype) for j, dtype in enumerate([np.int64, np.int64, np.float32, np.int64])]
+
+        # (gathers from the flattened batch with linear pixel indices, faster than indexing with (b, y, x):)
+        b = torch.arange(batch_size, device=images.device).view(batch_size, 1, 1)*src_h
+        pixels = images.reshape(-1, 3)
+        def gather(y, x):
+            index = ((b + y[:, :, None])*src_w + x[:, None, :]).view(-1)
+            return pixels.index_select(0, index).view(batch_size, self.crop_h, self.crop_w, 3).float()
+        wy = wy[:, :, None, None]
+        wx = wx[:, None, :, None]
+        top = gather(y0, x0)
+        top += (gather(y0, x1) - top)*wx
+        bottom = gather(y1, x0)
+        bottom += (gather(y1, x1) - bottom)*wx
+        top += (bottom - top)*wy
+        images = top.round_().to(torch.uint8)
+        labels = labels.reshape(-1).index_select(0, ((b + y[:, :, None])*src_w + x[:, None, :]).view(-1)).view(batch_size, self.crop_h, self.crop_w)
+
+        pad_value = self.pad_value.to(images.device)
+        for i, (_, _, (pad_y, pad_x)) in enumerate(coords):
+            images[i, pad_y] = pad_value
+            images[i, :, pad_x] = pad_value
+            labels[i, pad_y] = self.ignore_label
+            labels[i, :, pad_x] = self.ignore_label
+
+        return images, labels
+
+imread_reduced_flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+def get_image_reductions(img_path):
+    # (OpenCV only decodes JPEGs at a reduced resolution, other formats are
+    # decoded at full resolution and then resized, which saves nothing)
+    if osp.splitext(img_path)[1].lower() in [".jpg", ".jpeg"]:
+        return [1, 2, 4, 8]
+    return [1]
+
+def get_reduction(f_scale, reductions):
+    # (largest reduction r such that the image decoded at 1/r resolution is at
+    # least as large as the scaled image, so it is never upsampled)
+    return max([r for r in reductions if f_scale*r <= 1.0] + [1])
+
+def read_image(img_path, reduction=1):
+    return cv2.imread(img_path, imread_reduced_flags[reduction])
+
+def decode_image(img_bytes, reduction=1):
+    return cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8), imread_reduced_flags[reduction])
+
+def get_id2trainId_lut(id_to_trainid):
+    # (256-entry lookup table, ids that are not in id_to_trainid are kept as is)
+    lut = np.arange(256, dtype=np.uint8)
     for k, v in id_to_trainid.items():
-        label_copy[label == k] = v
-    return label_copy
+        if 0 <= k < 256:
+            lut[k] = v
+    return lut
+
+def id2trainId(label, id_to_trainid):
+    # (id_to_trainid is either a dict or a lookup table from get_id2trainId_lut)
+    if isinstance(id_to_trainid, dict):
+        id_to_trainid = get_id2trainId_lut(id_to_trainid)
+    if label.dtype == np.uint8:
+        return cv2.LUT(label, id_to_trainid)
+    return id_to_trainid[label]
+
+class FileList(object):
+    """
+    Compact read-only list of the file dicts of a dataset. The strings of each
+    key are stored in one bytes table (plus an array of offsets) and all other
+    values in numpy arrays, instead of one dict per example. That is a handful
+    of python objects, which the DataLoader workers do not copy page by page by
+    touching their reference counts. files[i] returns a new dict.
+    """
+    def __init__(self, files):
+        self.num_files = len(files)
+        self.keys = list(files[0].keys()) if self.num_files > 0 else []
+        self.columns = {}
+        for key in self.keys:
+            values = [datafiles[key] for datafiles in files]
+            if isinstance(values[0], str):
+                encoded = [value.encode("utf-8") for value in values]
+                offsets = np.zeros((self.num_files + 1, ), dtype=np.int64)
+                np.cumsum([len(value) for value in encoded], out=offsets[1:])
+                self.columns[key] = (b"".join(encoded), offsets)
+            else:
+                self.columns[key] = np.array(values)
+
+    def __len__(self):
+        return self.num_files
+
+    def __getitem__(self, index):
+        datafiles = {}
+        for key in self.keys:
+            column = self.columns[key]
+            if isinstance(column, tuple):
+                table, offsets = column
+                datafiles[key] = table[offsets[index]:offsets[index + 1]].decode("utf-8")
+            else:
+                datafiles[key] = column[index].item()
+        return datafiles
+
+    def __iter__(self):
+        for i in range(self.num_files):
+            yield self[i]
+
+def get_num_examples(num_unique_examples, max_iters):
+    # (the augmentation datasets used to repeat their files ceil(max_iters/num_unique_examples)
+    # times, they now only have this length and map index to index % num_unique_examples)
+    if max_iters is None:
+        return num_unique_examples
+    return num_unique_examples*int(np.ceil(float(max_iters) / num_unique_examples))
 
 ################################################################################
 # Cityscapes
 ################################################################################
 class DatasetCityscapesAugmentation(data.Dataset):
-    def __init__(self, root, list_path, max_iters=None, crop_size=(512, 512), ignore_label=255):
+    def __init__(self, root, list_path, max_iters=None, crop_size=(512, 512), ignore_label=255, uint8_output=False, batch_augment=False):
         self.root = root
         self.list_path = list_path
         self.crop_h, self.crop_w = crop_size
         self.ignore_label = ignore_label
+        self.uint8_output = uint8_output # (uint8 images/labels, see BatchNormalize)
+        self.batch_augment = batch_augment # (unaugmented uint8 examples, see BatchAugment)
 
         self.img_ids = [i_id.strip().split() for i_id in open(list_path)]
-        print ("DatasetCityscapesAugmentation - num unique examples: %d" % len(self.img_ids))
-        if not max_iters==None:
-                self.img_ids = self.img_ids * int(np.ceil(float(max_iters) / len(self.img_ids)))
-        print ("DatasetCityscapesAugmentation - num examples: %d" % len(self.img_ids))
 
-        self.files = []
+        files = []
         for item in self.img_ids:
             image_path, label_path = item
             name = osp.splitext(osp.basename(label_path))[0]
             img_file = osp.join(self.root, image_path)
-            label_file = osp.join(self.root, label_path)
-            self.files.append({
+            files.append({
                 "img": img_file,
-                "label": label_file,
+                "label": osp.join(self.root, label_path),
                 "name": name,
                 "weight": 1
             })
+        self.files = FileList(get_manifest(files, "cityscapes_" + osp.splitext(osp.basename(list_path))[0]))
+        self.num_examples = get_num_examples(len(self.files), max_iters)
+        print ("DatasetCityscapesAugmentation - num unique examples: %d" % len(self.files))
+        print ("DatasetCityscapesAugmentation - num examples: %d" % self.num_examples)
 
         self.id_to_trainid = {-1: ignore_label, 0: ignore_label, 1: ignore_label, 2: ignore_label,
                               3: ignore_label, 4: ignore_label, 5: ignore_label, 6: ignore_label,
@@ -58,73 +351,68 @@ class DatasetCityscapesAugmentation(data.Dataset):
                               14: ignore_label, 15: ignore_label, 16: ignore_label, 17: 5,
                               18: ignore_label, 19: 6, 20: 7, 21: 8, 22: 9, 23: 10, 24: 11, 25: 12, 26: 13, 27: 14,
                               28: 15, 29: ignore_label, 30: ignore_label, 31: 16, 32: 17, 33: 18}
+        self.id_to_trainid_lut = get_id2trainId_lut(self.id_to_trainid)
 
     def __len__(self):
-        return len(self.files)
+        return self.num_examples
 
-    def __getitem__(self, index):
-        datafiles = self.files[index]
-        image = cv2.imread(datafiles["img"], cv2.IMREAD_COLOR)
+    def read_example(self, datafiles, reduction=1):
+        # (the image is decoded at 1/reduction resolution, the label always at full resolution)
+        image = read_image(datafiles["img"], reduction)
         label = cv2.imread(datafiles["label"], cv2.IMREAD_GRAYSCALE)
+        if image is None or label is None:
+            return None, None
 
-        label = id2trainId(label, self.id_to_trainid)
+        if not datafiles["label_is_trainId"]:
+            label = id2trainId(label, self.id_to_trainid_lut)
 
-        size = image.shape
-        name = datafiles["name"]
-        image, label = generate_scale_label(image, label)
-        image = np.asarray(image, np.float32)
+        return image, label
 
-        mean = (102.9801, 115.9465, 122.7717)
-        image = image[:,:,::-1]
-        image -= mean
+    def get_reductions(self, datafiles):
+        return get_image_reductions(datafiles["img"])
 
-        img_h, img_w = label.shape
-        pad_h = max(self.crop_h - img_h, 0)
-        pad_w = max(self.crop_w - img_w, 0)
-        if pad_h > 0 or pad_w > 0:
-            img_pad = cv2.copyMakeBorder(image, 0, pad_h, 0,
-                pad_w, cv2.BORDER_CONSTANT,
-                value=(0.0, 0.0, 0.0))
-            label_pad = cv2.copyMakeBorder(label, 0, pad_h, 0,
-                pad_w, cv2.BORDER_CONSTANT,
-                value=(self.ignore_label,))
-        else:
-            img_pad, label_pad = image, label
+    def __getitem__(self, index):
+        datafiles = self.files[index % len(self.files)]
+        if self.batch_augment:
+            image, label = self.read_example(datafiles)
+            if image is None: # (only if a file went missing after the manifest was built)
+                return self.__getitem__(0)
+            return np.array(image), np.array(label), np.array(label.shape + (3, )), datafiles["name"]
 
-        img_h, img_w = label_pad.shape
-        h_off = random.randint(0, img_h - self.crop_h)
-        w_off = random.randint(0, img_w - self.crop_w)
-        image = np.asarray(img_pad[h_off : h_off+self.crop_h, w_off : w_off+self.crop_w], np.float32)
-        label = np.asarray(label_pad[h_off : h_off+self.crop_h, w_off : w_off+self.crop_w], np.float32)
-        image = image.transpose((2, 0, 1))
+        f_scale = get_random_scale()
+        image, label = self.read_example(datafiles, get_reduction(f_scale, self.get_reductions(datafiles)))
 
-        flip = np.random.choice(2)*2 - 1
-        image = image[:, :, ::flip]
-        label = label[:, ::flip]
+        if image is None: # (only if a file went missing after the manifest was built)
+            return self.__getitem__(0)
 
-        return image.copy(), label.copy(), np.array(size), name
+        size = label.shape + (3, )
+        name = datafiles["name"]
+        image, label = augment_example(image, label, (self.crop_h, self.crop_w), self.ignore_label, f_scale, self.uint8_output)
+
+        return image, label, np.array(size), name
 
 class DatasetCityscapesEval(data.Dataset):
-    def __init__(self, root, list_path, ignore_label=255):
+    def __init__(self, root, list_path, ignore_label=255, scale=1.0):
         self.root = root
         self.list_path = list_path
         self.ignore_label = ignore_label
+        self.scale = scale # (images and labels are resized by this factor, e.g. 0.5 for a faster approximate evaluation)
 
         self.img_ids = [i_id.strip().split() for i_id in open(list_path)]
-        print ("DatasetCityscapesEval - num examples: %d" % len(self.img_ids))
 
-        self.files = []
+        files = []
         for item in self.img_ids:
             image_path, label_path = item
             name = osp.splitext(osp.basename(label_path))[0]
             img_file = osp.join(self.root, image_path)
-            label_file = osp.join(self.root, label_path)
-            self.files.append({
+            files.append({
                 "img": img_file,
-                "label": label_file,
+                "label": osp.join(self.root, label_path),
                 "name": name,
                 "weight": 1
             })
+        self.files = get_manifest(files, "cityscapes_" + osp.splitext(osp.basename(list_path))[0])
+        print ("DatasetCityscapesEval - num examples: %d" % len(self.files))
 
         self.id_to_trainid = {-1: ignore_label, 0: ignore_label, 1: ignore_label, 2: ignore_label,
                               3: ignore_label, 4: ignore_label, 5: ignore_label, 6: ignore_label,
@@ -132,19 +420,32 @@ class DatasetCityscapesEval(data.Dataset):
                               14: ignore_label, 15: ignore_label, 16: ignore_label, 17: 5,
                               18: ignore_label, 19: 6, 20: 7, 21: 8, 22: 9, 23: 10, 24: 11, 25: 12, 26: 13, 27: 14,
                               28: 15, 29: ignore_label, 30: ignore_label, 31: 16, 32: 17, 33: 18}
+        self.id_to_trainid_lut = get_id2trainId_lut(self.id_to_trainid)
 
     def __len__(self):
         return len(self.files)
 
-    def __getitem__(self, index):
-        datafiles = self.files[index]
+    def read_example(self, datafiles):
         image = cv2.imread(datafiles["img"], cv2.IMREAD_COLOR)
         label = cv2.imread(datafiles["label"], cv2.IMREAD_GRAYSCALE)
+        if image is None or label is None:
+            return None, None
 
-        if not os.path.exists(datafiles["img"]): # (26 out of 25000 images are missing)
-            return self.__getitem__(0)
+        if not datafiles["label_is_trainId"]:
+            label = id2trainId(label, self.id_to_trainid_lut)
+
+        if self.scale != 1.0:
+            image = cv2.resize(image, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+            label = cv2.resize(label, (image.shape[1], image.shape[0]), interpolation=cv2.INTER_NEAREST)
+
+        return image, label
 
-        label = id2trainId(label, self.id_to_trainid)
+    def __getitem__(self, index):
+        datafiles = self.files[index]
+        image, label = self.read_example(datafiles)
+
+        if image is None: # (only if a file went missing after the manifest was built)
+            return self.__getitem__(0)
 
         size = image.shape
         name = datafiles["name"]
@@ -165,17 +466,20 @@ class DatasetCityscapesEvalSeq(data.Dataset):
 
         self.img_dir = self.data_path + "/leftImg8bit/demoVideo/stuttgart_" + sequence + "/"
 
-        self.examples = []
-
-        file_names = os.listdir(self.img_dir)
+        files = []
+        file_names = sorted(file_name for file_name in os.listdir(self.img_dir) if file_name.endswith("_leftImg8bit.png")) # (in frame order)
         for file_name in file_names:
             img_id = file_name.split("_leftImg8bit.png")[0]
 
             img_path = self.img_dir + file_name
 
+            files.append({"img": img_path, "img_id": img_id})
+
+        self.examples = []
+        for datafiles in get_manifest(files, "cityscapes_demoVideo_" + sequence):
             example = {}
-            example["img_path"] = img_path
-            example["img_id"] = img_id
+            example["img_path"] = datafiles["img"]
+            example["img_id"] = datafiles["img_id"]
             self.examples.append(example)
 
         self.num_examples = len(self.examples)
@@ -208,11 +512,13 @@ class DatasetCityscapesEvalSeq(data.Dataset):
 # Synscapes
 ################################################################################
 class DatasetSynscapesAugmentation(data.Dataset):
-    def __init__(self, root, root_meta, type="train", max_iters=None, crop_size=(512, 512), ignore_label=255):
+    def __init__(self, root, root_meta, type="train", max_iters=None, crop_size=(512, 512), ignore_label=255, uint8_output=False, batch_augment=False):
         self.root = root
         self.root_meta = root_meta
         self.crop_h, self.crop_w = crop_size
         self.ignore_label = ignore_label
+        self.uint8_output = uint8_output
+        self.batch_augment = batch_augment
 
         if type == "train":
             with open(root_meta + "/train_img_ids.pkl", "rb") as file: # (needed for python3)
@@ -223,19 +529,18 @@ class DatasetSynscapesAugmentation(data.Dataset):
         else:
             raise Exception("type must be either 'train' or 'val'!")
 
-        print ("DatasetSynscapesAugmentation - num unique examples: %d" % len(self.img_ids))
-        if not max_iters==None:
-                self.img_ids = self.img_ids * int(np.ceil(float(max_iters) / len(self.img_ids)))
-        print ("DatasetSynscapesAugmentation - num examples: %d" % len(self.img_ids))
-
-        self.files = []
+        files = []
         for img_id in self.img_ids:
-            self.files.append({
+            files.append({
                 "img": self.root + "/img/rgb-2k/" + img_id + ".png",
                 "label": self.root_meta + "/gtFine/" + img_id + ".png",
                 "name": img_id,
                 "weight": 1
             })
+        self.files = FileList(get_manifest(files, "synscapes_" + type))
+        self.num_examples = get_num_examples(len(self.files), max_iters)
+        print ("DatasetSynscapesAugmentation - num unique examples: %d" % len(self.files))
+        print ("DatasetSynscapesAugmentation - num examples: %d" % self.num_examples)
 
         self.id_to_trainid = {-1: ignore_label, 0: ignore_label, 1: ignore_label, 2: ignore_label,
                               3: ignore_label, 4: ignore_label, 5: ignore_label, 6: ignore_label,
@@ -243,54 +548,45 @@ class DatasetSynscapesAugmentation(data.Dataset):
                               14: ignore_label, 15: ignore_label, 16: ignore_label, 17: 5,
                               18: ignore_label, 19: 6, 20: 7, 21: 8, 22: 9, 23: 10, 24: 11, 25: 12, 26: 13, 27: 14,
                               28: 15, 29: ignore_label, 30: ignore_label, 31: 16, 32: 17, 33: 18}
+        self.id_to_trainid_lut = get_id2trainId_lut(self.id_to_trainid)
 
     def __len__(self):
-        return len(self.files)
+        return self.num_examples
 
-    def __getitem__(self, index):
-        datafiles = self.files[index]
-        image = cv2.imread(datafiles["img"], cv2.IMREAD_COLOR)
+    def read_example(self, datafiles, reduction=1):
+        # (the image is decoded at 1/reduction resolution, the label always at full resolution)
+        image = read_image(datafiles["img"], reduction)
         label = cv2.imread(datafiles["label"], cv2.IMREAD_GRAYSCALE)
+        if image is None or label is None:
+            return None, None
 
-        if not os.path.exists(datafiles["img"]): # (26 out of 25000 images are missing)
-            return self.__getitem__(0)
+        if not datafiles["label_is_trainId"]:
+            label = id2trainId(label, self.id_to_trainid_lut)
 
-        label = id2trainId(label, self.id_to_trainid)
+        return image, label
 
-        size = image.shape
-        name = datafiles["name"]
-        image, label = generate_scale_label(image, label)
-        image = np.asarray(image, np.float32)
+    def get_reductions(self, datafiles):
+        return get_image_reductions(datafiles["img"])
 
-        mean = (102.9801, 115.9465, 122.7717)
-        image = image[:,:,::-1]
-        image -= mean
+    def __getitem__(self, index):
+        datafiles = self.files[index % len(self.files)]
+        if self.batch_augment:
+            image, label = self.read_example(datafiles)
+            if image is None: # (only if a file went missing after the manifest was built)
+                return self.__getitem__(0)
+            return np.array(image), np.array(label), np.array(label.shape + (3, )), datafiles["name"]
 
-        img_h, img_w = label.shape
-        pad_h = max(self.crop_h - img_h, 0)
-        pad_w = max(self.crop_w - img_w, 0)
-        if pad_h > 0 or pad_w > 0:
-            img_pad = cv2.copyMakeBorder(image, 0, pad_h, 0,
-                pad_w, cv2.BORDER_CONSTANT,
-                value=(0.0, 0.0, 0.0))
-            label_pad = cv2.copyMakeBorder(label, 0, pad_h, 0,
-                pad_w, cv2.BORDER_CONSTANT,
-                value=(self.ignore_label,))
-        else:
-            img_pad, label_pad = image, label
+        f_scale = get_random_scale()
+        image, label = self.read_example(datafiles, get_reduction(f_scale, self.get_reductions(datafiles)))
 
-        img_h, img_w = label_pad.shape
-        h_off = random.randint(0, img_h - self.crop_h)
-        w_off = random.randint(0, img_w - self.crop_w)
-        image = np.asarray(img_pad[h_off : h_off+self.crop_h, w_off : w_off+self.crop_w], np.float32)
-        label = np.asarray(label_pad[h_off : h_off+self.crop_h, w_off : w_off+self.crop_w], np.float32)
-        image = image.transpose((2, 0, 1))
+        if image is None: # (only if a file went missing after the manifest was built)
+            return self.__getitem__(0)
 
-        flip = np.random.choice(2)*2 - 1
-        image = image[:, :, ::flip]
-        label = label[:, ::flip]
+        size = label.shape + (3, )
+        name = datafiles["name"]
+        image, label = augment_example(image, label, (self.crop_h, self.crop_w), self.ignore_label, f_scale, self.uint8_output)
 
-        return image.copy(), label.copy(), np.array(size), name
+        return image, label, np.array(size), name
 
 class DatasetSynscapesEval(data.Dataset):
     def __init__(self, root, root_meta, type="val", ignore_label=255):
@@ -307,16 +603,16 @@ class DatasetSynscapesEval(data.Dataset):
         else:
             raise Exception("type must be either 'train' or 'val'!")
 
-        print ("DatasetSynscapesEval - num examples: %d" % len(self.img_ids))
-
-        self.files = []
+        files = []
         for img_id in self.img_ids:
-            self.files.append({
+            files.append({
                 "img": self.root + "/img/rgb-2k/" + img_id + ".png",
                 "label": self.root_meta + "/gtFine/" + img_id + ".png",
                 "name": img_id,
                 "weight": 1
             })
+        self.files = get_manifest(files, "synscapes_" + type)
+        print ("DatasetSynscapesEval - num examples: %d" % len(self.files))
 
         self.id_to_trainid = {-1: ignore_label, 0: ignore_label, 1: ignore_label, 2: ignore_label,
                               3: ignore_label, 4: ignore_label, 5: ignore_label, 6: ignore_label,
@@ -324,19 +620,28 @@ class DatasetSynscapesEval(data.Dataset):
                               14: ignore_label, 15: ignore_label, 16: ignore_label, 17: 5,
                               18: ignore_label, 19: 6, 20: 7, 21: 8, 22: 9, 23: 10, 24: 11, 25: 12, 26: 13, 27: 14,
                               28: 15, 29: ignore_label, 30: ignore_label, 31: 16, 32: 17, 33: 18}
+        self.id_to_trainid_lut = get_id2trainId_lut(self.id_to_trainid)
 
     def __len__(self):
         return len(self.files)
 
-    def __getitem__(self, index):
-        datafiles = self.files[index]
+    def read_example(self, datafiles):
         image = cv2.imread(datafiles["img"], cv2.IMREAD_COLOR)
         label = cv2.imread(datafiles["label"], cv2.IMREAD_GRAYSCALE)
+        if image is None or label is None:
+            return None, None
 
-        if not os.path.exists(datafiles["img"]): # (26 out of 25000 images are missing)
-            return self.__getitem__(0)
+        if not datafiles["label_is_trainId"]:
+            label = id2trainId(label, self.id_to_trainid_lut)
+
+        return image, label
+
+    def __getitem__(self, index):
+        datafiles = self.files[index]
+        image, label = self.read_example(datafiles)
 
-        label = id2trainId(label, self.id_to_trainid)
+        if image is None: # (only if a file went missing after the manifest was built)
+            return self.__getitem__(0)
 
         size = image.shape
         name = datafiles["name"]
@@ -351,6 +656,367 @@ class DatasetSynscapesEval(data.Dataset):
 
         return image.copy(), label.copy(), np.array(size), name
 
+################################################################################
+# Decoded cache (built by utils/dataset_cache.py)
+################################################################################
+class DatasetCacheAugmentation(DatasetCityscapesAugmentation):
+    def __init__(self, cache_path, max_iters=None, crop_size=(512, 512), ignore_label=255, uint8_output=False, batch_augment=False):
+        self.cache = DecodedCache(cache_path)
+        self.crop_h, self.crop_w = crop_size
+        self.ignore_label = ignore_label
+        self.uint8_output = uint8_output
+        self.batch_augment = batch_augment
+
+        self.img_ids = list(range(len(self.cache)))
+        self.num_examples = get_num_examples(len(self.img_ids), max_iters)
+        print ("DatasetCacheAugmentation - num unique examples: %d" % len(self.img_ids))
+        print ("DatasetCacheAugmentation - num examples: %d" % self.num_examples)
+
+        files = []
+        for i in self.img_ids:
+            files.append({
+                "index": i,
+                "name": self.cache.names[i],
+                "weight": 1
+            })
+        self.files = FileList(files)
+
+    def read_example(self, datafiles, reduction=1):
+        # (zero-copy views into the memory-mapped shards, the labels are trainIds)
+        return self.cache.get(datafiles["index"], reduction)
+
+    def get_reductions(self, datafiles):
+        return self.cache.reductions
+
+class DatasetCacheEval(DatasetCityscapesEval):
+    def __init__(self, cache_path, ignore_label=255):
+        self.cache = DecodedCache(cache_path)
+        self.ignore_label = ignore_label
+
+        print ("DatasetCacheEval - num examples: %d" % len(self.cache))
+
+        self.files = []
+        for i in range(len(self.cache)):
+            self.files.append({
+                "index": i,
+                "name": self.cache.names[i],
+                "weight": 1
+            })
+
+    def read_example(self, datafiles):
+        return self.cache.get(datafiles["index"])
+
+################################################################################
+# Tar shards (written by utils/tar_shards.py)
+################################################################################
+class DatasetTarShardsAugmentation(data.IterableDataset):
+    """
+    Streams examples from tar shards: the shards are split across distributed
+    ranks and DataLoader workers, each worker reads num_open_shards of its
+    shards at a time (interleaved) and shuffles the examples in a buffer of
+    shuffle_buffer examples. Iterates forever unless num_epochs is given.
+    """
+    def __init__(self, shards_path, crop_size=(512, 512), ignore_label=255, shuffle_buffer=256, num_open_shards=4, num_epochs=None, seed=0, uint8_output=False):
+        self.shards = list_shards(shards_path)
+        self.crop_h, self.crop_w = crop_size
+        self.ignore_label = ignore_label
+        self.uint8_output = uint8_output
+        self.shuffle_buffer = shuffle_buffer
+        self.num_open_shards = num_open_shards
+        self.num_epochs = num_epochs
+        self.seed = seed
+        self.epoch = 0
+
+        if len(self.shards) == 0:
+            raise Exception("no shards found in %s!" % shards_path)
+        print ("DatasetTarShardsAugmentation - num shards: %d" % len(self.shards))
+
+        self.id_to_trainid = {-1: ignore_label, 0: ignore_label, 1: ignore_label, 2: ignore_label,
+                              3: ignore_label, 4: ignore_label, 5: ignore_label, 6: ignore_label,
+                              7: 0, 8: 1, 9: ignore_label, 10: ignore_label, 11: 2, 12: 3, 13: 4,
+                              14: ignore_label, 15: ignore_label, 16: ignore_label, 17: 5,
+                              18: ignore_label, 19: 6, 20: 7, 21: 8, 22: 9, 23: 10, 24: 11, 25: 12, 26: 13, 27: 14,
+                              28: 15, 29: ignore_label, 30: ignore_label, 31: 16, 32: 17, 33: 18}
+        self.id_to_trainid_lut = get_id2trainId_lut(self.id_to_trainid)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def get_worker_shards(self, epoch):
+        # (all ranks/workers shuffle the shards with the same seed, then take every n-th one)
+        rank, world_size = 0, 1
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+        worker_id, num_workers = 0, 1
+        worker_info = data.get_worker_info()
+        if worker_info is not None:
+            worker_id, num_workers = worker_info.id, worker_info.num_workers
+
+        shards = list(self.shards)
+        random.Random(self.seed + epoch).shuffle(shards)
+        return shards[rank*num_workers + worker_id::world_size*num_workers]
+
+    def read_examples(self, shards):
+        # (round-robin over num_open_shards open shards at a time)
+        pending = list(shards)
+        open_shards = []
+        while len(pending) > 0 or len(open_shards) > 0:
+            while len(open_shards) < self.num_open_shards and len(pending) > 0:
+                open_shards.append(read_shard(pending.pop(0)))
+            for shard in list(open_shards):
+                example = next(shard, None)
+                if example is None:
+                    open_shards.remove(shard)
+                else:
+                    yield example
+
+    def shuffle_examples(self, examples, rng):
+        buffer = []
+        for example in examples:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(example)
+                continue
+            i = rng.randint(0, len(buffer) - 1)
+            yield buffer[i]
+            buffer[i] = example
+        rng.shuffle(buffer)
+        for example in buffer:
+            yield example
+
+    def decode_example(self, example, reduction=1):
+        image = decode_image(example["img"], reduction)
+        label = cv2.imdecode(np.frombuffer(example["label"], dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if not example["label_is_trainId"]:
+            label = id2trainId(label, self.id_to_trainid_lut)
+        return image, label
+
+    def __iter__(self):
+        epoch = self.epoch
+        while self.num_epochs is None or epoch < self.epoch + self.num_epochs:
+            shards = self.get_worker_shards(epoch)
+            if len(shards) == 0: # (more ranks*workers than shards)
+                return
+            rng = random.Random("%d-%d-%s" % (self.seed, epoch, shards[0])) # (differs between workers, deterministic across runs)
+            for example in self.shuffle_examples(self.read_examples(shards), rng):
+                f_scale = get_random_scale()
+                reductions = [1, 2, 4, 8] if example["img"][0:2] == b"\xff\xd8" else [1] # (JPEG)
+                image, label = self.decode_example(example, get_reduction(f_scale, reductions))
+                if image is None or label is None:
+                    continue
+                size = label.shape + (3, )
+                image, label = augment_example(image, label, (self.crop_h, self.crop_w), self.ignore_label, f_scale, self.uint8_output)
+                yield image, label, np.array(size), example["name"]
+            epoch += 1
+
+################################################################################
+# Image folders (inference only, no labels)
+################################################################################
+image_extensions = [".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp", ".ppm", ".pgm"]
+
+def scan_images(source, extensions=image_extensions):
+    """
+    Yields the image files of source while it is scanned (the listing is never
+    held in memory as a whole): a directory (scanned recursively, depth first,
+    the files of each directory in the order of the file system and its
+    subdirectories in sorted order), a glob pattern (e.g. "uploads/**/*.jpg")
+    or a list of files.
+    :return: generator of (path, name), name is the path relative to the
+             directory (or the file name), without extension and with "/" -> "__"
+    """
+    if isinstance(source, (list, tuple)):
+        for path in source:
+            yield path, osp.splitext(osp.basename(path))[0]
+    elif osp.isdir(source):
+        dirs = [source]
+        while len(dirs) > 0:
+            subdirs = []
+            with os.scandir(dirs.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subdirs.append(entry.path) # (only the subdirectories are kept)
+                    elif entry.is_file() and osp.splitext(entry.name)[1].lower() in extensions:
+                        name = osp.splitext(osp.relpath(entry.path, source))[0]
+                        yield entry.path, name.replace(os.sep, "__")
+            # (depth first, subdirectories in sorted order:)
+            dirs += sorted(subdirs, reverse=True)
+    else:
+        for path in glob.iglob(source, recursive=True):
+            if osp.splitext(path)[1].lower() in extensions:
+                yield path, osp.splitext(osp.basename(path))[0]
+
+class DatasetImageFolder(data.IterableDataset):
+    """
+    Images of a directory, glob pattern or file list (see scan_images()) of any
+    format readable by OpenCV and any size, e.g. to score uploads of tens of
+    thousands of JPEGs. The files are decoded in num_threads threads, at most
+    max_queue_size ahead, and yielded in scan order (split across DataLoader
+    workers). Images with more than max_pixels pixels are downscaled. Use
+    batch_size=1 unless all images have the same size, or batch_size=None and
+    a BucketBatcher (utils/batching.py) to batch images of similar size.
+    """
+    def __init__(self, source, num_threads=8, max_queue_size=32, max_pixels=None, extensions=image_extensions):
+        self.source = source
+        self.num_threads = num_threads
+        self.max_queue_size = max_queue_size
+        self.max_pixels = max_pixels
+        self.extensions = extensions
+
+    def read_example(self, path):
+        image = cv2.imread(path, cv2.IMREAD_COLOR)
+        if image is None:
+            return None, None
+        size = image.shape
+        if self.max_pixels is not None and size[0]*size[1] > self.max_pixels:
+            f = np.sqrt(float(self.max_pixels)/(size[0]*size[1]))
+            image = cv2.resize(image, None, fx=f, fy=f, interpolation=cv2.INTER_AREA)
+
+        image = np.asarray(image, np.float32)
+
+        mean = (102.9801, 115.9465, 122.7717)
+        image = image[:,:,::-1]
+        image -= mean
+
+        image = image.transpose((2, 0, 1))
+
+        return image.copy(), size
+
+    def __iter__(self):
+        worker_info = data.get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+
+        pending = collections.deque()
+        with ThreadPoolExecutor(self.num_threads) as executor:
+            for i, (path, name) in enumerate(scan_images(self.source, self.extensions)):
+                if i % num_workers != worker_id:
+                    continue
+                pending.append((path, name, executor.submit(self.read_example, path)))
+                if len(pending) >= self.max_queue_size:
+                    example = self.get_example(*pending.popleft())
+                    if example is not None:
+                        yield example
+            while len(pending) > 0:
+                example = self.get_example(*pending.popleft())
+                if example is not None:
+                    yield example
+
+    def get_example(self, path, name, future):
+        image, size = future.result()
+        if image is None:
+            print ("could not read %s, skipping" % path)
+            return None
+        return image, np.array(size), name
+
+################################################################################
+# Videos (inference only, no labels)
+################################################################################
+class DatasetVideo(data.IterableDataset):
+    """
+    The frames of a video file (any format readable by OpenCV, e.g. MP4/AVI),
+    decoded in a background thread at most max_queue_size frames ahead and
+    yielded in order (use num_workers=0 or 1). Only every frame_stride-th frame
+    is decoded (the others are skipped with grab()), start_time/end_time (in
+    seconds, None: start/end of the video) select a time range. The names are
+    "<video name>_<frame index, 6 digits>", i.e. they sort in frame order.
+    The frames are read until the end of the video (or end_time), the frame
+    count of the container is only used for len() (an estimate, TypeError if
+    the container does not report it).
+    """
+    def __init__(self, video_path, frame_stride=1, start_time=None, end_time=None, max_queue_size=16):
+        self.video_path = video_path
+        self.frame_stride = frame_stride
+        self.max_queue_size = max_queue_size
+        self.name = osp.splitext(osp.basename(video_path))[0]
+
+        capture = cv2.VideoCapture(video_path)
+        if not capture.isOpened():
+            raise Exception("could not open the video %s!" % video_path)
+        self.fps = capture.get(cv2.CAP_PROP_FPS)
+        num_frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) # (from the container, can be approximate, 0 or -1 if unknown)
+        capture.release()
+        if (start_time is not None or end_time is not None) and not self.fps > 0:
+            raise Exception("the video %s has no valid frame rate (%s), cannot select a time range!" % (video_path, self.fps))
+
+        self.start_frame = 0 if start_time is None else int(round(start_time*self.fps))
+        self.end_frame = None if end_time is None else int(round(end_time*self.fps)) # (None: until the last decodable frame)
+
+        self.num_examples = None # (estimate)
+        if num_frames > 0:
+            end_frame = num_frames if self.end_frame is None else min(num_frames, self.end_frame)
+            self.num_examples = len(range(self.start_frame, end_frame, self.frame_stride))
+        elif self.end_frame is not None:
+            self.num_examples = len(range(self.start_frame, self.end_frame, self.frame_stride))
+        print ("DatasetVideo - num examples: %s (estimate, %s, %.2f fps)" % (self.num_examples, video_path, self.fps))
+
+    def __len__(self):
+        if self.num_examples is None:
+            raise TypeError("the number of frames of %s is unknown!" % self.video_path)
+        return self.num_examples
+
+    def read_frames(self, frames, stop):
+        def put(item):
+            # (gives up when the iteration was stopped, instead of blocking on a full queue)
+            while not stop.is_set():
+                try:
+                    frames.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        capture = cv2.VideoCapture(self.video_path)
+        try:
+            if self.start_frame > 0:
+                capture.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
+            index = self.start_frame
+            while self.end_frame is None or index < self.end_frame:
+                if stop.is_set():
+                    break
+                if (index - self.start_frame) % self.frame_stride != 0:
+                    if not capture.grab():
+                        break
+                    index += 1
+                    continue
+                success, frame = capture.read()
+                if not success:
+                    break
+                put((index, frame))
+                index += 1
+        except Exception as e:
+            put(e)
+        finally:
+            capture.release()
+            put(None)
+
+    def __iter__(self):
+        worker_info = data.get_worker_info()
+        if worker_info is not None and worker_info.num_workers > 1:
+            raise Exception("DatasetVideo yields the frames in order, use num_workers=0 or 1!")
+
+        frames = queue.Queue(self.max_queue_size)
+        stop = threading.Event()
+        thread = threading.Thread(target=self.read_frames, args=(frames, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = frames.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                index, image = item
+                size = image.shape
+                image = np.asarray(image, np.float32)
+
+                mean = (102.9801, 115.9465, 122.7717)
+                image = image[:,:,::-1]
+                image -= mean
+
+                image = image.transpose((2, 0, 1))
+
+                yield image.copy(), np.array(size), "%s_%06d" % (self.name, index)
+        finally:
+            stop.set()
+            thread.join()
+
 ################## Njupt ############
 class Njupteval(data.Dataset):
     def __init__(self, root, list_path=None, ignore_label=255):
@@ -359,19 +1025,20 @@ class Njupteval(data.Dataset):
         self.ignore_label = ignore_label
 
         self.img_ids = ['njupt1.jpg','njupt2.jpg','njupt3.jpg']
-        print ("DatasetCityscapesEval - num examples: %d" % len(self.img_ids))
+        print ("Njupteval - num examples: %d" % len(self.img_ids))
 
-        self.files = []
+        files = []
         for item in self.img_ids:
             name = os.path.splitext(item)[0]
             image_path = item
             # name = osp.splitext(osp.basename(label_path))[0]
             img_file = osp.join(self.root, image_path)
-            self.files.append({
+            files.append({
                 "img": img_file,
                 "name": name,
                 "weight": 1
             })
+        self.files = get_manifest(files, "njupt")
 
         self.id_to_trainid = {-1: ignore_label, 0: ignore_label, 1: ignore_label, 2: ignore_label,
                               3: ignore_label, 4: ignore_label, 5: ignore_label, 6: ignore_label,
@@ -388,9 +1055,6 @@ class Njupteval(data.Dataset):
         image = cv2.imread(datafiles["img"], cv2.IMREAD_COLOR)
         #label = cv2.imread(datafiles["label"], cv2.IMREAD_GRAYSCALE)
 
-        if not os.path.exists(datafiles["img"]): # (26 out of 25000 images are missing)
-            return self.__getitem__(0)
-
         #label = id2trainId(label, self.id_to_trainid)
 
         size = image.shape
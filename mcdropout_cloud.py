@@ -1,145 +1,66 @@
 # code-checked
 # server-checked
 
-import torch
-import torch.nn as nn
-from torch.autograd import Variable
-import torch.nn.functional as F
-from torch.utils import data
-
-import os
 import numpy as np
-import cv2
+from torch.utils.data import Subset
 
 from datasets import DatasetCityscapesEval
 from models.model_mcdropout import get_model
 
-from utils.utils import label_img_2_color, get_confusion_matrix
+from utils.writer import ImageWriter
+from utils.data_loader import get_data_loader
+from utils.inference import UncertaintyEngine, load_models, ImageSink, MetricsSink, CalibrationSink, UncertaintyErrorSink
+from utils.prediction_cache import PredictionCache
+from utils.result_store import ResultWriter, ResultStoreSink
+from utils.class_histograms import get_class_histograms
+from utils.fast_eval import get_stratified_subset, FastEvalSink
 
 model_id = "mcdropout"
 M = 8
 data_dir = "./data/cityscapes"
 data_list = "./lists/cityscapes/val.lst"
 batch_size = 4
+num_workers = 4
 num_classes = 19
 max_entropy = np.log(num_classes)
+outputs = ["img", "label_overlayed", "pred_overlayed", "entropy", "hentropy"] # (per-image outputs to write, see utils/writer.py)
+prediction_cache_path = None # (e.g. "./prediction_cache": model outputs are reused from earlier runs, ~10 MB per image and model, see utils/prediction_cache.py)
+result_outputs = [] # (per-pixel values to store in output_path/results, e.g. ["p", "entropy", "hentropy", "mutual_information"], see utils/result_store.py)
+
 
+fast_eval = False # (approximate mIoU/calibration with confidence intervals on a subset of the images and pixels, see utils/fast_eval.py)
+fast_eval_num_images = 100
+fast_eval_scale = 0.5
+fast_eval_pixels_per_class = 1000 # (max number of scored pixels of each class in each image)
 
-eval_dataset = DatasetCityscapesEval(root=data_dir, list_path=data_list)
-eval_loader = data.DataLoader(eval_dataset, batch_size=batch_size, shuffle=False, pin_memory=True)
+if fast_eval:
+    eval_dataset = DatasetCityscapesEval(root=data_dir, list_path=data_list, scale=fast_eval_scale)
+    subset, subset_weights = get_stratified_subset(get_class_histograms(eval_dataset.files, eval_dataset.id_to_trainid_lut), fast_eval_num_images)
+    image_weights = {eval_dataset.files[index]["name"]: weight for index, weight in zip(subset, subset_weights)}
+    eval_dataset = Subset(eval_dataset, subset.tolist())
+else:
+    eval_dataset = DatasetCityscapesEval(root=data_dir, list_path=data_list)
+eval_loader = get_data_loader(eval_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
 
 
 
 model_is = [0, 1, 2, 3]
-models = []
-for i in model_is:
-    restore_from = "./trained_models/%s_%d/checkpoint_20000.pth" % (model_id, i)
-    deeplab = get_model(num_classes=num_classes)
-    deeplab.load_state_dict(torch.load(restore_from))
-    model = nn.DataParallel(deeplab)
-    model.eval()
-    model.cuda()
-    models.append(model)
+models = load_models(["./trained_models/%s_%d/checkpoint_20000.pth" % (model_id, i) for i in model_is], get_model, num_classes=num_classes)
+cache = None if prediction_cache_path is None else PredictionCache(prediction_cache_path)
+engine = UncertaintyEngine(models, M=M, num_classes=num_classes, cache=cache)
 
 N = len(models)
-M_float = float(M)
-N_float = float(N)
-print ("M: {}, N:{}".format(M_float, N_float))
+print ("M: {}, N:{}".format(float(M), float(N)))
 
 output_path = "./training_logs/%s_M%d_N%d_eval" % (model_id, M, len(models))
-if not os.path.exists(output_path):
-    os.makedirs(output_path)
-
-confusion_matrix = np.zeros((num_classes, num_classes))
-for step, batch in enumerate(eval_loader):
-    with torch.no_grad():
-        print ("%d/%d" % (step+1, len(eval_loader)))
-
-        image, label, _, name = batch
-        # (image has shape: (batch_size, 3, h, w))
-        # (label has shape: (batch_size, h, w))
-
-        batch_size = image.size(0)
-        h = image.size(2)
-        w = image.size(3)
-
-        hp = np.zeros((batch_size, h, w, len(models))) # (shape: (batch_size, h, w, N))
-        exp_pred = np.zeros((batch_size, h, w, num_classes))
-        for i, model in enumerate(models):
-            p = torch.zeros(batch_size, num_classes, h, w).cuda() # (shape: (batch_size, num_classes, h, w))
-            for j in range(M):
-                logits_downsampled = model(Variable(image).cuda()) # (shape: (batch_size, num_classes, h/8, w/8))
-                logits = F.upsample(input=logits_downsampled , size=(h, w), mode='bilinear', align_corners=True) # (shape: (batch_size, num_classes, h, w))
-                p_value = F.softmax(logits, dim=1) # (shape: (batch_size, num_classes, h, w))
-                p = p + p_value/M_float
-            p_numpy = p.cpu().data.numpy().transpose(0, 2, 3, 1) # (array of shape: (batch_size, h, w, num_classes))
-            p_numpy = p_numpy + 1e-6
-            exp_pred = exp_pred + p_numpy/N_float
-            entropy = -np.sum(p_numpy*np.log(p_numpy), axis=3) # (shape: (batch_size, h, w))
-            hp[:,:,:,i] = entropy/N_float
-        
-        entropy = hp.sum(axis=3) # (shape: (batch_size, h, w))
-        hentropy = -np.sum(hp*np.log(hp), axis=3) # (shape: (batch_size, h, w))
-
-        pred_label_imgs_raw = np.argmax(exp_pred, axis=3).astype(np.uint8)
-        seg_pred = np.argmax(exp_pred, axis=3).astype(np.uint8)
-        m_seg_pred = np.ma.masked_array(seg_pred, mask=torch.eq(label, 255))
-        np.ma.set_fill_value(m_seg_pred, 20)
-        seg_pred = m_seg_pred
-
-        seg_gt = label.numpy().astype(np.int)
-        ignore_index = seg_gt != 255
-        seg_gt = seg_gt[ignore_index]
-        seg_pred = seg_pred[ignore_index]
-        confusion_matrix += get_confusion_matrix(seg_gt, seg_pred, num_classes)
-
-        #entropy = -np.sum(p_numpy*np.log(p_numpy), axis=3) # (shape: (batch_size, h, w))
-        #pred_label_imgs_raw = np.argmax(, axis=3).astype(np.uint8)
-        for i in range(image.size(0)):
-            if i == 0:
-                img = image[i].data.cpu().numpy()
-                img = np.transpose(img, (1, 2, 0)) # (shape: (img_h, img_w, 3))
-                img = img + np.array([102.9801, 115.9465, 122.7717])
-                img = img[:,:,::-1]
-                cv2.imwrite(output_path + "/" + name[i] + "_img.png", img)
-
-                label_img = label[i].data.cpu().numpy()
-                label_img = label_img.astype(np.uint8)
-                label_img_color = label_img_2_color(label_img)[:,:,::-1]
-                overlayed_img = 0.30*img + 0.70*label_img_color
-                overlayed_img = overlayed_img.astype(np.uint8)
-                cv2.imwrite(output_path + "/" + name[i] + "_label_overlayed.png", overlayed_img)
-
-                pred_label_img = pred_label_imgs_raw[i]
-                pred_label_img = pred_label_img.astype(np.uint8)
-                pred_label_img_color = label_img_2_color(pred_label_img)[:,:,::-1]
-                overlayed_img = 0.30*img + 0.70*pred_label_img_color
-                overlayed_img = overlayed_img.astype(np.uint8)
-                cv2.imwrite(output_path + "/" + name[i] + "_pred_overlayed.png", overlayed_img)
-
-                entropy_img = entropy[i]
-                entropy_img = (entropy_img/max_entropy)*255
-                entropy_img = entropy_img.astype(np.uint8)
-                entropy_img = cv2.applyColorMap(entropy_img, cv2.COLORMAP_HOT)
-                cv2.imwrite(output_path + "/" + name[i] + "_entropy.png", entropy_img)
-
-                hentropy_img = hentropy[i]
-                #print("shape: ",hentropy_img.shape)
-                hentropy_img = (hentropy_img)*255
-                #hentropy_img = (hentropy_img)*255
-                hentropy_img = hentropy_img.astype(np.uint8)
-                hentropy_img = cv2.applyColorMap(hentropy_img, cv2.COLORMAP_OCEAN)
-                cv2.imwrite(output_path + "/" + name[i] + "_hentropy.png", hentropy_img)
-
-        # # # # # # # # # # # # # # # # # debug START:
-        if step == 0:
-            break
-        # # # # # # # # # # # # # # # # # debug END:
-
-pos = confusion_matrix.sum(1)
-res = confusion_matrix.sum(0)
-tp = np.diag(confusion_matrix)
 
-IU_array = (tp / np.maximum(1.0, pos + res - tp))
-mean_IU = IU_array.mean()
-print({'meanIU':mean_IU, 'IU_array':IU_array})
+if fast_eval:
+    sinks = [FastEvalSink(num_classes, pixels_per_class=fast_eval_pixels_per_class, image_weights=image_weights)]
+else:
+    writer = ImageWriter(output_path, outputs=outputs)
+    # (only the first example of each batch is visualized:)
+    sinks = [ImageSink(writer, max_images_per_batch=1, max_entropy=max_entropy), MetricsSink(num_classes), CalibrationSink(num_classes),
+             UncertaintyErrorSink({"entropy": max_entropy, "mutual_information": max_entropy, "hentropy": N/np.e})] # (hentropy <= N/e)
+    if len(result_outputs) > 0:
+        sinks.append(ResultStoreSink(ResultWriter(output_path + "/results"), outputs=result_outputs))
+engine.run(eval_loader, sinks)
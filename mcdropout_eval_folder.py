@@ -0,0 +1,42 @@
+# code-checked
+# server-checked
+
+import numpy as np
+
+from datasets import DatasetImageFolder
+from models.model_mcdropout import get_model
+
+from utils.writer import ImageWriter
+from utils.data_loader import get_data_loader
+from utils.batching import BucketBatcher
+from utils.inference import UncertaintyEngine, load_models, ImageSink, UncertaintyStatsSink
+
+# (MC-dropout predictions for a folder of unlabeled images of any sizes, e.g. ./njupt)
+
+model_id = "mcdropout_0"
+M = 8
+
+data_dir = "./njupt"
+num_workers = 4
+bucket_size = 64 # (image sizes are rounded up to multiples of bucket_size and padded)
+max_batch_size = 4
+max_batch_pixels = 4*1024*2048 # (max number of (padded) pixels per batch)
+max_image_pixels = 1024*2048 # (larger images are downscaled)
+num_classes = 19
+max_entropy = np.log(num_classes)
+outputs = ["img", "pred_overlayed", "entropy"] # (per-image outputs to write, see utils/writer.py)
+
+eval_dataset = DatasetImageFolder(data_dir, max_pixels=max_image_pixels)
+eval_loader = get_data_loader(eval_dataset, batch_size=None, num_workers=num_workers)
+eval_batches = BucketBatcher(eval_loader, bucket_size=bucket_size, max_pixels=max_batch_pixels, max_batch_size=max_batch_size)
+
+output_path = "./training_logs/%s_M%d_eval_folder" % (model_id, M)
+writer = ImageWriter(output_path, outputs=outputs)
+
+restore_from = "./trained_models/%s/checkpoint_20000.pth" % model_id
+models = load_models([restore_from], get_model, num_classes=num_classes)
+engine = UncertaintyEngine(models, M=M, num_classes=num_classes)
+print (float(M))
+
+# (the padding of the batches is cropped from the outputs and excluded from the statistics)
+engine.run(eval_batches, [ImageSink(writer, max_entropy=max_entropy), UncertaintyStatsSink(["entropy"])])
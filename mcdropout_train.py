@@ -3,7 +3,6 @@
 
 import torch
 import torch.nn as nn
-from torch.utils import data
 import numpy as np
 import pickle
 from torch.autograd import Variable
@@ -11,9 +10,11 @@ import torch.optim as optim
 import os
 from utils.criterion import CriterionCrossEntropy
 from utils.parallel import DataParallelModel, DataParallelCriterion
+from utils.data_loader import get_data_loader, StepSampler, WeightedStepSampler
+from utils.class_histograms import get_class_histograms, get_repeat_factors
 
 from models.model_mcdropout import get_model
-from datasets import DatasetCityscapesAugmentation
+from datasets import DatasetCityscapesAugmentation, BatchNormalize, BatchAugment
 
 import matplotlib
 matplotlib.use("Agg")
@@ -30,6 +31,7 @@ snapshot_dir_base = "./training_logs/%s" % model_id
 data_dir = "./data/cityscapes"
 data_list = "./lists/cityscapes/train.lst"
 batch_size = 6
+num_workers = 4
 random_mirror = True
 random_scale = True
 momentum = 0.9
@@ -37,6 +39,8 @@ weight_decay = 0.0005
 save_pred_every = 5000
 num_steps = 20000
 ignore_label = 255
+batch_augment = False # (augment the collated batches in the main process with BatchAugment, instead of each example in the workers)
+rare_class_sampling = False # (oversample the images with rider/train/motorcycle pixels, see utils/class_histograms.py)
 
 def lr_poly(base_lr, iter, max_iter, power):
     return base_lr*((1-float(iter)/max_iter)**(power))
@@ -72,8 +76,15 @@ for model_i in range(3,M):
     criterion = DataParallelCriterion(criterion)
     criterion.cuda()
 
-    train_dataset = DatasetCityscapesAugmentation(root=data_dir, list_path=data_list, max_iters=num_steps*batch_size, crop_size=crop_size)
-    train_loader = data.DataLoader(dataset=train_dataset, batch_size=batch_size, shuffle=True, num_workers=0, pin_memory=True)
+    train_dataset = DatasetCityscapesAugmentation(root=data_dir, list_path=data_list, crop_size=crop_size, uint8_output=True, batch_augment=batch_augment)
+    if rare_class_sampling:
+        histograms = get_class_histograms(train_dataset.files, train_dataset.id_to_trainid_lut)
+        sampler = WeightedStepSampler(get_repeat_factors(histograms), num_steps*batch_size, seed=model_i)
+    else:
+        sampler = StepSampler(len(train_dataset), num_steps*batch_size, seed=model_i)
+    train_loader = get_data_loader(train_dataset, batch_size=batch_size, num_workers=num_workers, seed=model_i, sampler=sampler)
+    normalize = BatchNormalize() # (the workers return uint8 images, normalized on the GPU)
+    augment = BatchAugment(crop_size=crop_size, ignore_label=ignore_label, seed=model_i)
 
     optimizer = optim.SGD([{'params': filter(lambda p: p.requires_grad, deeplab.parameters()), 'lr': learning_rate }],
                 lr=learning_rate, momentum=momentum, weight_decay=weight_decay)
@@ -83,7 +94,9 @@ for model_i in range(3,M):
     batch_train_losses = []
     for i_iter, batch in enumerate(train_loader):
         images, labels, _, _ = batch
-        images = Variable(images.cuda())
+        if batch_augment:
+            images, labels = augment(images, labels)
+        images = Variable(normalize(images.cuda(non_blocking=True)))
         labels = Variable(labels.long().cuda())
 
         preds = model(images)
@@ -0,0 +1,93 @@
+# code-checked
+# server-checked
+
+import collections
+import numpy as np
+import torch
+
+def get_bucket(h, w, bucket_size):
+    # (the size of the padded images of the bucket of an (h, w) image)
+    return int(np.ceil(h/float(bucket_size)))*bucket_size, int(np.ceil(w/float(bucket_size)))*bucket_size
+
+class BucketBatcher(object):
+    """
+    Batches examples (image, size, name) of different sizes, e.g. from
+    DatasetImageFolder through a DataLoader with batch_size=None: the images
+    are grouped by size bucket (h and w rounded up to multiples of bucket_size)
+    and zero-padded (the mean color, the images are mean subtracted) at the
+    bottom/right to the bucket size. A bucket is emitted when one more image
+    would exceed max_pixels (padded pixels per batch) or max_batch_size, and
+    the fullest bucket is emitted early when more than max_pending images are
+    waiting. Batches are not in input order.
+
+    Yields (images, valid_sizes, sizes, names): images of shape (batch_size, 3, H, W),
+    valid_sizes (int64 tensor of shape (batch_size, 2)) the (h, w) of each image
+    before padding, see strip_padding()/get_valid_mask().
+    """
+    def __init__(self, examples, bucket_size=64, max_pixels=4*1024*2048, max_batch_size=16, max_pending=64):
+        self.examples = examples
+        self.bucket_size = bucket_size
+        self.max_pixels = max_pixels
+        self.max_batch_size = max_batch_size
+        self.max_pending = max_pending
+
+    def is_full(self, bucket, num_images):
+        return num_images >= self.max_batch_size or (num_images + 1)*bucket[0]*bucket[1] > self.max_pixels
+
+    def get_batch(self, bucket, examples):
+        images, valid_sizes = pad_images([image for image, _, _ in examples], bucket)
+        sizes = torch.stack([torch.as_tensor(size) for _, size, _ in examples])
+        names = [name for _, _, name in examples]
+        return images, valid_sizes, sizes, names
+
+    def __iter__(self):
+        buckets = collections.OrderedDict()
+        num_pending = 0
+        for image, size, name in self.examples:
+            image = torch.as_tensor(image)
+            bucket = get_bucket(image.shape[1], image.shape[2], self.bucket_size)
+            buckets.setdefault(bucket, []).append((image, size, name))
+            num_pending += 1
+
+            if not self.is_full(bucket, len(buckets[bucket])):
+                if num_pending <= self.max_pending:
+                    continue
+                bucket = max(buckets, key=lambda bucket: len(buckets[bucket])*bucket[0]*bucket[1])
+
+            examples = buckets.pop(bucket)
+            num_pending -= len(examples)
+            yield self.get_batch(bucket, examples)
+
+        for bucket, examples in buckets.items():
+            yield self.get_batch(bucket, examples)
+
+def pad_images(images, bucket):
+    """
+    :param images: list of tensors of shape (3, h_i, w_i), h_i <= H and w_i <= W
+    :param bucket: (H, W)
+    :return: (images zero-padded at the bottom/right, shape (batch_size, 3, H, W),
+              valid_sizes, int64 tensor of shape (batch_size, 2))
+    """
+    padded_images = images[0].new_zeros((len(images), images[0].shape[0]) + tuple(bucket))
+    valid_sizes = torch.zeros((len(images), 2), dtype=torch.int64)
+    for i, image in enumerate(images):
+        h, w = image.shape[1:3]
+        padded_images[i, :, 0:h, 0:w] = image
+        valid_sizes[i, 0] = h
+        valid_sizes[i, 1] = w
+    return padded_images, valid_sizes
+
+def strip_padding(values, valid_sizes):
+    """
+    :param values: array/tensor of shape (batch_size, ..., H, W), e.g. the predictions of a BucketBatcher batch
+    :return: list of the unpadded values of each example, shapes (..., h, w)
+    """
+    return [values[i, ..., 0:int(h), 0:int(w)] for i, (h, w) in enumerate(valid_sizes.tolist())]
+
+def get_valid_mask(valid_sizes, h, w):
+    """
+    :return: bool tensor of shape (batch_size, h, w), False for the padding
+    """
+    rows = torch.arange(h, device=valid_sizes.device).view(1, h, 1) < valid_sizes[:, 0].view(-1, 1, 1)
+    cols = torch.arange(w, device=valid_sizes.device).view(1, 1, w) < valid_sizes[:, 1].view(-1, 1, 1)
+    return rows & cols
@@ -0,0 +1,116 @@
+# code-checked
+# server-checked
+
+# (usage, from the repository root: python -m utils.benchmark_visualization)
+
+import time
+import numpy as np
+import cv2
+
+from utils.visualization import images_2_bgr, label_imgs_2_color, overlay, values_2_color
+
+batch_size = 4
+h = 1024
+w = 2048
+num_classes = 19
+max_entropy = np.log(num_classes)
+num_runs = 5
+
+# (the per-image implementation used by the eval scripts before utils/visualization.py:)
+def label_img_2_color_masks(img):
+    img_height, img_width = img.shape
+
+    img_color = np.zeros((img_height, img_width, 3), dtype=np.uint8)
+
+    img_color[img == 0] = np.array([128, 64, 128])
+    img_color[img == 1] = np.array([244, 35,232])
+    img_color[img == 2] = np.array([70, 70, 70])
+    img_color[img == 3] = np.array([102,102,156])
+    img_color[img == 4] = np.array([190,153,153])
+    img_color[img == 5] = np.array([153,153,153])
+    img_color[img == 6] = np.array([250,170, 30])
+    img_color[img == 7] = np.array([220,220, 0])
+    img_color[img == 8] = np.array([107,142, 35])
+    img_color[img == 9] = np.array([152,251,152])
+    img_color[img == 10] = np.array([ 70,130,180])
+    img_color[img == 11] = np.array([220, 20, 60])
+    img_color[img == 12] = np.array([255, 0, 0])
+    img_color[img == 13] = np.array([0, 0, 142])
+    img_color[img == 14] = np.array([0, 0, 70])
+    img_color[img == 15] = np.array([0, 60,100])
+    img_color[img == 16] = np.array([0, 80,100])
+    img_color[img == 17] = np.array([0, 0,230])
+    img_color[img == 18] = np.array([119, 11, 32])
+
+    img_color[img == 255] = np.array([0, 0, 0])
+
+    return img_color
+
+def visualize_per_image(image, label, pred, entropy, hentropy):
+    outputs = []
+    for i in range(image.shape[0]):
+        img = image[i]
+        img = np.transpose(img, (1, 2, 0)) # (shape: (img_h, img_w, 3))
+        img = img + np.array([102.9801, 115.9465, 122.7717])
+        img = img[:,:,::-1]
+        outputs.append(img)
+
+        label_img_color = label_img_2_color_masks(label[i])[:,:,::-1]
+        overlayed_img = 0.30*img + 0.70*label_img_color
+        outputs.append(overlayed_img.astype(np.uint8))
+
+        pred_label_img_color = label_img_2_color_masks(pred[i])[:,:,::-1]
+        overlayed_img = 0.30*img + 0.70*pred_label_img_color
+        outputs.append(overlayed_img.astype(np.uint8))
+
+        entropy_img = (entropy[i]/max_entropy)*255
+        entropy_img = entropy_img.astype(np.uint8)
+        outputs.append(cv2.applyColorMap(entropy_img, cv2.COLORMAP_HOT))
+
+        hentropy_img = hentropy[i]*255
+        hentropy_img = hentropy_img.astype(np.uint8)
+        outputs.append(cv2.applyColorMap(hentropy_img, cv2.COLORMAP_OCEAN))
+    return outputs
+
+def visualize_batched(image, label, pred, entropy, hentropy):
+    imgs = images_2_bgr(image)
+    label_overlayed_imgs = overlay(imgs, label_imgs_2_color(label, bgr=True))
+    pred_overlayed_imgs = overlay(imgs, label_imgs_2_color(pred, bgr=True))
+    entropy_imgs = values_2_color(entropy, cv2.COLORMAP_HOT, max_value=max_entropy)
+    hentropy_imgs = values_2_color(hentropy, cv2.COLORMAP_OCEAN)
+    return [imgs, label_overlayed_imgs, pred_overlayed_imgs, entropy_imgs, hentropy_imgs]
+
+def benchmark(func, *args):
+    times = []
+    for _ in range(num_runs):
+        start_time = time.time()
+        func(*args)
+        times.append(time.time() - start_time)
+    return np.median(times)
+
+if __name__ == "__main__":
+    np.random.seed(0)
+    img_bgr = np.random.randint(0, 256, size=(batch_size, h, w, 3)).astype(np.float32)
+    image = (img_bgr[:, :, :, ::-1] - np.array([102.9801, 115.9465, 122.7717], dtype=np.float32)).transpose(0, 3, 1, 2)
+    label = np.random.randint(0, num_classes + 1, size=(batch_size, h, w)).astype(np.uint8)
+    label[label == num_classes] = 255
+    pred = np.random.randint(0, num_classes, size=(batch_size, h, w)).astype(np.uint8)
+    entropy = np.random.uniform(0, max_entropy, size=(batch_size, h, w))
+    hentropy = np.random.uniform(0, 1, size=(batch_size, h, w))
+
+    # (check that both produce the same images, up to rounding in the blending:)
+    outputs_per_image = visualize_per_image(image, label, pred, entropy, hentropy)
+    outputs_batched = visualize_batched(image, label, pred, entropy, hentropy)
+    for i in range(batch_size):
+        for j in range(len(outputs_batched)):
+            diff = np.abs(outputs_per_image[i*len(outputs_batched) + j].astype(np.float64) - outputs_batched[j][i].astype(np.float64))
+            assert diff.max() <= 1.0, "output %d of example %d differs by %g" % (j, i, diff.max())
+    assert np.array_equal(label_imgs_2_color(label[0]), label_img_2_color_masks(label[0]))
+
+    time_colorize_masks = benchmark(lambda: [label_img_2_color_masks(label[i]) for i in range(batch_size)])
+    time_colorize_lut = benchmark(label_imgs_2_color, label)
+    print ("label_img_2_color: %.1f ms (masks) vs %.1f ms (lut), batch of %d %dx%d" % (1000*time_colorize_masks, 1000*time_colorize_lut, batch_size, h, w))
+
+    time_per_image = benchmark(visualize_per_image, image, label, pred, entropy, hentropy)
+    time_batched = benchmark(visualize_batched, image, label, pred, entropy, hentropy)
+    print ("all outputs: %.1f ms (per image) vs %.1f ms (batched), speedup: %.1fx" % (1000*time_per_image, 1000*time_batched, time_per_image/time_batched))
@@ -0,0 +1,115 @@
+# code-checked
+# server-checked
+
+# (usage, from the repository root: python -m utils.class_histograms)
+#
+# Index of the trainId pixel histogram of each label file, built once (in
+# parallel threads) and extended with the labels that are not in it yet when
+# it is used with new file lists:
+#   manifest_dir/class_histograms.pkl ({label path: int64 array of shape (num_classes, )})
+# Class weights and sampling weights for any subset of the examples are then
+# computed from the histograms only.
+
+import os
+import pickle
+import numpy as np
+import cv2
+from multiprocessing.pool import ThreadPool
+
+from utils.manifest import manifest_dir
+
+index_path = manifest_dir + "/class_histograms.pkl"
+
+rare_classes = [12, 16, 17] # (rider, train, motorcycle)
+
+def get_class_histograms(files, id_to_trainid_lut, num_classes=19, num_workers=8):
+    """
+    :param files: the files of one of the dataset classes in datasets.py (dicts with "label" and "label_is_trainId")
+    :param id_to_trainid_lut: lookup table for the labels that are not trainId labels (see get_id2trainId_lut())
+    :return: int64 array of shape (len(files), num_classes), the number of pixels of each class in each label
+    """
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path, "rb") as file:
+            index = pickle.load(file)
+
+    label_files = {}
+    for datafiles in files:
+        if datafiles["label"] not in index:
+            label_files[datafiles["label"]] = datafiles["label_is_trainId"]
+
+    def read_histogram(label_path):
+        label = cv2.imread(label_path, cv2.IMREAD_GRAYSCALE)
+        if label is None:
+            print ("could not read %s, using an empty histogram" % label_path)
+            return np.zeros((num_classes, ), dtype=np.int64)
+        if not label_files[label_path]:
+            label = cv2.LUT(label, id_to_trainid_lut)
+        return np.bincount(label.ravel(), minlength=256)[0:num_classes].astype(np.int64)
+
+    if len(label_files) > 0:
+        pool = ThreadPool(num_workers)
+        label_paths = list(label_files.keys())
+        for step, histogram in enumerate(pool.imap(read_histogram, label_paths, chunksize=8)):
+            if (step % 500) == 0:
+                print ("computing class histograms, step: %d/%d" % (step+1, len(label_paths)))
+            index[label_paths[step]] = histogram
+        pool.close()
+
+        if not os.path.exists(manifest_dir):
+            os.makedirs(manifest_dir)
+        with open(index_path + ".tmp", "wb") as file:
+            pickle.dump(index, file)
+        os.replace(index_path + ".tmp", index_path)
+
+    return np.stack([index[datafiles["label"]][0:num_classes] for datafiles in files])
+
+def get_class_weights(histograms):
+    """
+    Class weights according to the ENet paper, 1/log(1.02 + class probability).
+
+    :param histograms: array of shape (num_examples, num_classes), e.g. get_class_histograms()[subset]
+    :return: array of shape (num_classes, )
+    """
+    counts = histograms.sum(axis=0).astype(np.float64)
+    probs = counts/max(1.0, counts.sum())
+    return 1.0/np.log(1.02 + probs)
+
+def get_repeat_factors(histograms, classes=rare_classes, threshold=0.2, min_pixels=1000):
+    """
+    Per-example sampling weights that oversample the examples showing rare
+    classes (repeat factor sampling, as in the LVIS paper): a class that is
+    present in a fraction f < threshold of the examples gets the factor
+    sqrt(threshold/f), each example gets the largest factor of its classes
+    (at least 1).
+
+    :param classes: only these classes are considered (None: all classes)
+    :param min_pixels: a class counts as present in an example with at least this many pixels
+    :return: float64 array of shape (num_examples, ), for a WeightedStepSampler
+    """
+    present = histograms >= min_pixels # (shape: (num_examples, num_classes))
+    if classes is not None:
+        present = present[:, classes]
+    fractions = present.mean(axis=0)
+    class_factors = np.maximum(1.0, np.sqrt(threshold/np.maximum(fractions, 1e-12)))
+    return np.maximum(1.0, (present*class_factors[np.newaxis, :]).max(axis=1))
+
+if __name__ == "__main__":
+    from datasets import DatasetCityscapesEval, DatasetSynscapesEval
+
+    cityscapes_path = "./data/cityscapes"
+    synscapes_path = "./data/synscapes"
+    synscapes_meta_path = "./data/synscapes_meta"
+
+    train_datasets = []
+    if os.path.exists(cityscapes_path):
+        train_datasets.append(("Cityscapes", DatasetCityscapesEval(root=cityscapes_path, list_path="./lists/cityscapes/train.lst")))
+    if os.path.exists(synscapes_meta_path + "/train_img_ids.pkl"):
+        train_datasets.append(("Synscapes", DatasetSynscapesEval(root=synscapes_path, root_meta=synscapes_meta_path, type="train")))
+
+    for name, dataset in train_datasets:
+        histograms = get_class_histograms(dataset.files, dataset.id_to_trainid_lut)
+        repeat_factors = get_repeat_factors(histograms)
+        print ("%s class weights: %s" % (name, np.round(get_class_weights(histograms), 4).tolist()))
+        print ("%s examples with rare classes: %d/%d, sampled %.2fx as often" % (name, (repeat_factors > 1).sum(), len(repeat_factors),
+               repeat_factors[repeat_factors > 1].mean()/repeat_factors.mean() if (repeat_factors > 1).any() else 1.0))
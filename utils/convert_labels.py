@@ -0,0 +1,70 @@
+# code-checked
+# server-checked
+
+# (usage, from the repository root: python -m utils.convert_labels)
+#
+# Converts all Cityscapes/Synscapes label images (ids) once to trainId label
+# images (ignore_label: 255), which are used by the dataset classes in
+# datasets.py instead of converting each label in __getitem__.
+
+import os
+import pickle
+import cv2
+
+from datasets import get_id2trainId_lut, id2trainId, get_trainId_label_path
+
+cityscapes_path = "./data/cityscapes"
+cityscapes_lists = ["./lists/cityscapes/train.lst", "./lists/cityscapes/val.lst"]
+
+synscapes_meta_path = "./data/synscapes_meta"
+synscapes_lists = [synscapes_meta_path + "/train_img_ids.pkl", synscapes_meta_path + "/val_img_ids.pkl"]
+
+ignore_label = 255
+id_to_trainid = {-1: ignore_label, 0: ignore_label, 1: ignore_label, 2: ignore_label,
+                 3: ignore_label, 4: ignore_label, 5: ignore_label, 6: ignore_label,
+                 7: 0, 8: 1, 9: ignore_label, 10: ignore_label, 11: 2, 12: 3, 13: 4,
+                 14: ignore_label, 15: ignore_label, 16: ignore_label, 17: 5,
+                 18: ignore_label, 19: 6, 20: 7, 21: 8, 22: 9, 23: 10, 24: 11, 25: 12, 26: 13, 27: 14,
+                 28: 15, 29: ignore_label, 30: ignore_label, 31: 16, 32: 17, 33: 18}
+id_to_trainid_lut = get_id2trainId_lut(id_to_trainid)
+
+def convert_labels(label_paths, overwrite=False):
+    for step, label_path in enumerate(label_paths):
+        if (step % 100) == 0:
+            print ("converting labels, step: %d/%d" % (step+1, len(label_paths)))
+
+        trainId_label_path = get_trainId_label_path(label_path)
+        if os.path.exists(trainId_label_path) and not overwrite:
+            continue
+
+        label = cv2.imread(label_path, cv2.IMREAD_GRAYSCALE)
+        if label is None:
+            print ("could not read %s, skipping" % label_path)
+            continue
+
+        label = id2trainId(label, id_to_trainid_lut)
+
+        # (write to a temporary file first, so that a partially written file is never used:)
+        tmp_path = trainId_label_path + ".tmp.png"
+        cv2.imwrite(tmp_path, label)
+        os.replace(tmp_path, trainId_label_path)
+
+if __name__ == "__main__":
+    label_paths = []
+    for list_path in cityscapes_lists:
+        if os.path.exists(list_path) and os.path.exists(cityscapes_path):
+            for line in open(list_path):
+                image_path, label_path = line.strip().split()
+                label_paths.append(os.path.join(cityscapes_path, label_path))
+    print ("num Cityscapes labels: %d" % len(label_paths))
+    convert_labels(label_paths)
+
+    label_paths = []
+    for list_path in synscapes_lists:
+        if os.path.exists(list_path):
+            with open(list_path, "rb") as file:
+                img_ids = pickle.load(file)
+            for img_id in img_ids:
+                label_paths.append(synscapes_meta_path + "/gtFine/" + img_id + ".png")
+    print ("num Synscapes labels: %d" % len(label_paths))
+    convert_labels(label_paths)
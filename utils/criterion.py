@@ -6,10 +6,12 @@ import torch
 from torch.nn import functional as F
 
 class CriterionCrossEntropy(nn.Module):
-    def __init__(self, ignore_index=255):
+    def __init__(self, ignore_index=255, weight=None):
         super(CriterionCrossEntropy, self).__init__()
         self.ignore_index = ignore_index
-        weight = torch.FloatTensor([0.8373, 0.918, 0.866, 1.0345, 1.0166, 0.9969, 0.9754, 1.0489, 0.8786, 1.0023, 0.9539, 0.9843, 1.1116, 0.9037, 1.0865, 1.0955, 1.0865, 1.1529, 1.0507])
+        if weight is None:
+            weight = [0.8373, 0.918, 0.866, 1.0345, 1.0166, 0.9969, 0.9754, 1.0489, 0.8786, 1.0023, 0.9539, 0.9843, 1.1116, 0.9037, 1.0865, 1.0955, 1.0865, 1.1529, 1.0507]
+        weight = torch.FloatTensor(weight) # (e.g. get_class_weights() in utils/class_histograms.py)
         self.criterion = torch.nn.CrossEntropyLoss(weight=weight, ignore_index=ignore_index)
 
     def forward(self, preds, target):
@@ -0,0 +1,164 @@
+# code-checked
+# server-checked
+
+import random
+import time
+import numpy as np
+import torch
+import torch.multiprocessing
+from torch.utils import data
+
+def seed_worker(worker_id):
+    # (torch seeds each DataLoader worker with base_seed + worker_id, base_seed
+    # comes from the generator of the DataLoader. The datasets sample their
+    # augmentations with random and np.random, which are otherwise identical
+    # in all (forked) workers, so they are seeded from it as well)
+    seed = torch.initial_seed() % 2**32
+    random.seed(seed)
+    np.random.seed(seed)
+
+class StepSampler(data.Sampler):
+    """
+    Yields num_samples indices (forever if None) in 0, ..., num_examples-1, as
+    consecutive random permutations of all examples (one per epoch), instead of
+    a dataset that repeats its examples to cover all training steps.
+    """
+    def __init__(self, num_examples, num_samples=None, seed=0):
+        self.num_examples = num_examples
+        self.num_samples = num_samples
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed)
+
+    def __len__(self):
+        if self.num_samples is None:
+            raise TypeError("StepSampler with num_samples=None has no length!")
+        return self.num_samples
+
+    def __iter__(self):
+        num_yielded = 0
+        while self.num_samples is None or num_yielded < self.num_samples:
+            for index in torch.randperm(self.num_examples, generator=self.generator).tolist():
+                if self.num_samples is not None and num_yielded == self.num_samples:
+                    return
+                yield index
+                num_yielded += 1
+
+class WeightedStepSampler(data.Sampler):
+    """
+    Yields num_samples indices (forever if None), drawn with replacement with
+    probabilities proportional to weights (e.g. get_repeat_factors() in
+    utils/class_histograms.py).
+    """
+    def __init__(self, weights, num_samples=None, seed=0):
+        self.weights = torch.as_tensor(np.asarray(weights), dtype=torch.float64)
+        self.num_samples = num_samples
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed)
+
+    def __len__(self):
+        if self.num_samples is None:
+            raise TypeError("WeightedStepSampler with num_samples=None has no length!")
+        return self.num_samples
+
+    def __iter__(self):
+        num_yielded = 0
+        while self.num_samples is None or num_yielded < self.num_samples:
+            num_draws = len(self.weights)
+            if self.num_samples is not None:
+                num_draws = min(num_draws, self.num_samples - num_yielded)
+            for index in torch.multinomial(self.weights, num_draws, replacement=True, generator=self.generator).tolist():
+                yield index
+            num_yielded += num_draws
+
+class LoaderReport(object):
+    """
+    Wraps a DataLoader and prints the measured throughput (time to the first
+    batch, then batches/s and examples/s) once report_batches batches have
+    been loaded, in the first epoch only (or over the batches loaded so far
+    if the iteration ends earlier).
+    """
+    def __init__(self, loader, report_batches=20):
+        self.loader = loader
+        self.report_batches = report_batches
+        self.reported = False
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def report(self, first_batch_time, num_batches, num_examples, duration):
+        if num_batches == 0:
+            print ("loader: %d workers, first batch after %.2f s" % (self.loader.num_workers, first_batch_time))
+        else:
+            print ("loader: %d workers, first batch after %.2f s, then %.2f batches/s (%.1f examples/s)"
+                   % (self.loader.num_workers, first_batch_time, num_batches/duration, num_examples/duration))
+        self.reported = True
+
+    def __iter__(self):
+        if self.reported:
+            for batch in self.loader:
+                yield batch
+            return
+
+        start_time = time.time()
+        first_batch_time = None
+        num_batches = 0
+        num_examples = 0
+        try:
+            for step, batch in enumerate(self.loader):
+                if step == 0:
+                    first_batch_time = time.time() - start_time
+                    start_time = time.time()
+                elif not self.reported:
+                    num_batches += 1
+                    num_examples += 1 if self.loader.batch_size is None else len(batch[0])
+                    if step == self.report_batches:
+                        self.report(first_batch_time, num_batches, num_examples, time.time() - start_time)
+                yield batch
+        finally:
+            # (the loader ended (or the iteration was stopped) before report_batches batches:)
+            if not self.reported and first_batch_time is not None:
+                self.report(first_batch_time, num_batches, num_examples, max(1e-6, time.time() - start_time))
+
+def get_data_loader(dataset, batch_size, shuffle=False, num_workers=4, pin_memory=True, drop_last=False,
+                    persistent_workers=True, prefetch_factor=4, sharing_strategy="file_system", seed=0, report_batches=20,
+                    sampler=None):
+    """
+    Creates the DataLoader of all train/eval scripts.
+
+    :param num_workers: number of worker processes (0: load in the main process)
+    :param persistent_workers: keep the workers (and their open files/caches) alive between epochs
+    :param prefetch_factor: number of batches loaded in advance by each worker
+    :param sharing_strategy: torch.multiprocessing sharing strategy for the batches of
+                             the workers ("file_system" does not run out of file descriptors)
+    :param seed: seeds the shuffling and the augmentations of all workers, deterministically
+    :param report_batches: print the measured throughput after this many batches (None: no report)
+    :param sampler: e.g. a StepSampler (shuffle is then ignored)
+
+    batch_size=None yields the examples unbatched, e.g. for a BucketBatcher (utils/batching.py).
+    """
+    generator = torch.Generator()
+    generator.manual_seed(seed)
+
+    kwargs = {}
+    if num_workers > 0:
+        if sharing_strategy is not None:
+            torch.multiprocessing.set_sharing_strategy(sharing_strategy)
+        kwargs["persistent_workers"] = persistent_workers
+        kwargs["prefetch_factor"] = prefetch_factor
+        kwargs["worker_init_fn"] = seed_worker
+    else:
+        # (the datasets sample their augmentations in the main process:)
+        random.seed(seed)
+        np.random.seed(seed)
+
+    if isinstance(dataset, data.IterableDataset) or sampler is not None:
+        shuffle = False # (the iterable datasets and the samplers shuffle themselves)
+
+    loader = data.DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, sampler=sampler, num_workers=num_workers,
+                             pin_memory=pin_memory, drop_last=drop_last, generator=generator, **kwargs)
+    if report_batches is None:
+        return loader
+    return LoaderReport(loader, report_batches)
@@ -0,0 +1,154 @@
+# code-checked
+# server-checked
+
+# (usage, from the repository root: python -m utils.dataset_cache)
+#
+# Decodes all images and trainId labels of a dataset once and stores them as
+# raw uint8 arrays in fixed-layout shard files:
+#   cache_path/shard_00000.bin, shard_00001.bin, ...
+#   cache_path/index.pkl
+# For each example, the shard holds the image (h, w, 3) (BGR) directly
+# followed by its label (h, w) and by the image at the reduced resolutions
+# (1/2, ...) used for small augmentation scales. The index stores the names
+# of all examples and an int64 array of shape (num_examples, 5) with
+# (shard, image offset, label offset, h, w) for each example, plus an array
+# of shape (num_examples, 4) with (shard, image offset, h, w) per reduction.
+
+import os
+import pickle
+import numpy as np
+import cv2
+from multiprocessing.pool import ThreadPool
+
+class DecodedCache(object):
+    """
+    Read access to a cache built by build_cache(), the shards are memory-mapped
+    (lazily, once per process) and examples are returned as zero-copy views.
+    """
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        with open(cache_path + "/index.pkl", "rb") as file:
+            index = pickle.load(file)
+        self.names = index["names"]
+        self.records = index["records"] # (shape: (num_examples, 5))
+        self.reduced_records = index.get("reduced_records", {}) # (reduction: array of shape (num_examples, 4))
+        self.reductions = [1] + sorted(self.reduced_records.keys())
+        self.name_to_index = {name: i for i, name in enumerate(self.names)}
+        self.shards = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getstate__(self):
+        # (DataLoader workers open their own memory maps)
+        state = self.__dict__.copy()
+        state["shards"] = {}
+        return state
+
+    def get_shard(self, shard):
+        if shard not in self.shards:
+            self.shards[shard] = np.memmap(shard_path(self.cache_path, shard), dtype=np.uint8, mode="r")
+        return self.shards[shard]
+
+    def get(self, index, reduction=1):
+        """
+        :param reduction: return the image at 1/reduction resolution (one of self.reductions)
+        :return: image (uint8 array of shape (h/reduction, w/reduction, 3), BGR), label (uint8 array of shape (h, w))
+        """
+        shard, img_offset, label_offset, h, w = [int(x) for x in self.records[index]]
+        data = self.get_shard(shard)
+        label = data[label_offset:label_offset + h*w].reshape(h, w)
+        if reduction != 1:
+            shard, img_offset, h, w = [int(x) for x in self.reduced_records[reduction][index]]
+            data = self.get_shard(shard)
+        image = data[img_offset:img_offset + h*w*3].reshape(h, w, 3)
+        return image, label
+
+def shard_path(cache_path, shard):
+    return cache_path + "/shard_%05d.bin" % shard
+
+def get_reduced_image(image, reduction):
+    # (at exactly 1/2, INTER_AREA averages 2x2 pixels, same as the INTER_LINEAR resize in the augmentation)
+    h, w = image.shape[0:2]
+    return cv2.resize(image, (int(round(w/float(reduction))), int(round(h/float(reduction)))), interpolation=cv2.INTER_AREA)
+
+def build_cache(dataset, cache_path, shard_size=4*1024**3, num_workers=8, reductions=(2, )):
+    """
+    Decodes all unique examples of dataset (one of the dataset classes in
+    datasets.py, using its read_example()) and writes them to cache_path.
+
+    :param shard_size: max number of bytes per shard file
+    :param num_workers: number of decoding threads
+    :param reductions: also store the images at these reduced resolutions
+    """
+    if not os.path.exists(cache_path):
+        os.makedirs(cache_path)
+
+    # (the augmentation datasets repeat their files max_iters times, decode each one once:)
+    files = []
+    names = set()
+    for datafiles in dataset.files:
+        if datafiles["name"] not in names:
+            names.add(datafiles["name"])
+            files.append(datafiles)
+
+    names = []
+    records = []
+    reduced_records = {reduction: [] for reduction in reductions}
+    shard = 0
+    offset = 0
+    shard_file = open(shard_path(cache_path, shard) + ".tmp", "wb")
+    pool = ThreadPool(num_workers)
+    for step, (datafiles, (image, label)) in enumerate(zip(files, pool.imap(dataset.read_example, files, chunksize=4))):
+        if (step % 100) == 0:
+            print ("building cache, step: %d/%d" % (step+1, len(files)))
+
+        if image is None:
+            print ("could not read %s, skipping" % datafiles["img"])
+            continue
+
+        reduced_images = [get_reduced_image(image, reduction) for reduction in reductions]
+
+        h, w = label.shape
+        num_bytes = h*w*4 + sum([reduced_image.size for reduced_image in reduced_images])
+        if offset > 0 and offset + num_bytes > shard_size:
+            shard_file.close()
+            os.replace(shard_path(cache_path, shard) + ".tmp", shard_path(cache_path, shard))
+            shard += 1
+            offset = 0
+            shard_file = open(shard_path(cache_path, shard) + ".tmp", "wb")
+
+        shard_file.write(np.ascontiguousarray(image, dtype=np.uint8).tobytes())
+        shard_file.write(np.ascontiguousarray(label, dtype=np.uint8).tobytes())
+        names.append(datafiles["name"])
+        records.append([shard, offset, offset + h*w*3, h, w])
+        offset += h*w*4
+        for reduction, reduced_image in zip(reductions, reduced_images):
+            shard_file.write(np.ascontiguousarray(reduced_image, dtype=np.uint8).tobytes())
+            reduced_records[reduction].append([shard, offset, reduced_image.shape[0], reduced_image.shape[1]])
+            offset += reduced_image.size
+    pool.close()
+    shard_file.close()
+    os.replace(shard_path(cache_path, shard) + ".tmp", shard_path(cache_path, shard))
+
+    # (the index is written last, an interrupted build has no index:)
+    index = {"names": names, "records": np.array(records, dtype=np.int64).reshape(-1, 5),
+             "reduced_records": {reduction: np.array(reduced_records[reduction], dtype=np.int64).reshape(-1, 4) for reduction in reductions}}
+    with open(cache_path + "/index.pkl", "wb") as file:
+        pickle.dump(index, file)
+    print ("built cache of %d examples in %d shard(s): %s" % (len(names), shard+1, cache_path))
+
+if __name__ == "__main__":
+    from datasets import DatasetCityscapesEval, DatasetSynscapesEval
+
+    cityscapes_path = "./data/cityscapes"
+    synscapes_path = "./data/synscapes"
+    synscapes_meta_path = "./data/synscapes_meta"
+
+    for split in ["train", "val"]:
+        if os.path.exists(cityscapes_path):
+            dataset = DatasetCityscapesEval(root=cityscapes_path, list_path="./lists/cityscapes/%s.lst" % split)
+            build_cache(dataset, cityscapes_path + "/cache/%s" % split)
+        if os.path.exists(synscapes_meta_path + "/%s_img_ids.pkl" % split):
+            dataset = DatasetSynscapesEval(root=synscapes_path, root_meta=synscapes_meta_path, type=split)
+            build_cache(dataset, synscapes_meta_path + "/cache/%s" % split)
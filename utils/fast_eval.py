@@ -0,0 +1,176 @@
+# code-checked
+# server-checked
+
+# Approximate fast evaluation, e.g. to compare checkpoints during development:
+#   - a stratified subset of the images (get_stratified_subset(), from the
+#     class histograms of utils/class_histograms.py, so that the images with
+#     rare classes are still represented), evaluated at a reduced resolution
+#     (DatasetCityscapesEval(..., scale=0.5))
+#   - FastEvalSink scores only a class-stratified sample of the labeled pixels
+#     of each image (up to pixels_per_class pixels of each gt class, weighted
+#     by the inverse sampling probability) and reports the mIoU and the
+#     calibration metrics with percentile bootstrap confidence intervals
+#     (the images are resampled, the pixels of an image are correlated).
+# The estimates are approximations of the full evaluation (mcdropout_eval.py
+# with fast_eval = False), use the full evaluation for any reported numbers.
+
+import numpy as np
+import torch
+
+from utils.metrics import ConfusionMatrix, CalibrationMetrics
+
+def get_stratified_subset(histograms, num_images, seed=0, min_pixels=1000):
+    """
+    Each image is assigned to the stratum of its rarest present class (the
+    class present in the fewest images), the subset is drawn from the strata
+    proportionally to their size, at least one image from each stratum.
+
+    :param histograms: array of shape (num_examples, num_classes), see get_class_histograms()
+    :param min_pixels: a class counts as present in an image with at least this many pixels
+    :return: sorted indices of the subset (int64 array of shape (num_images, )),
+             the weight of each of them (images in its stratum/sampled images of its stratum)
+    """
+    num_examples, num_classes = histograms.shape
+    if num_images >= num_examples:
+        return np.arange(num_examples), np.ones((num_examples, ))
+
+    present = histograms >= min_pixels
+    class_frequencies = present.sum(axis=0)
+    # (images without any present class form the stratum num_classes:)
+    rarity = np.where(present, class_frequencies[np.newaxis, :], num_examples + 1)
+    strata = np.where(present.any(axis=1), np.argmin(rarity, axis=1), num_classes)
+
+    stratum_sizes = np.bincount(strata, minlength=num_classes + 1)
+    nonempty = np.nonzero(stratum_sizes)[0]
+    if num_images < len(nonempty):
+        raise Exception("num_images must be at least the number of strata (%d)!" % len(nonempty))
+
+    # (largest remainder allocation, after one image per stratum:)
+    allocation = np.zeros((num_classes + 1, ), dtype=np.int64)
+    allocation[nonempty] = 1
+    quotas = (num_images - len(nonempty))*(stratum_sizes - 1)/max(1, stratum_sizes.sum() - len(nonempty))
+    allocation += np.floor(quotas).astype(np.int64)
+    remainders = np.where(allocation < stratum_sizes, quotas - np.floor(quotas), -1.0)
+    allocation[np.argsort(-remainders, kind="stable")[0:(num_images - allocation.sum())]] += 1
+
+    random_state = np.random.RandomState(seed)
+    indices = []
+    weights = []
+    for stratum in nonempty:
+        stratum_indices = np.nonzero(strata == stratum)[0]
+        indices.append(random_state.choice(stratum_indices, allocation[stratum], replace=False))
+        weights.append(np.full((allocation[stratum], ), stratum_sizes[stratum]/allocation[stratum]))
+    indices = np.concatenate(indices)
+    weights = np.concatenate(weights)
+    order = np.argsort(indices)
+    return indices[order], weights[order]
+
+def sample_pixels(gt_label, pixels_per_class, num_classes, generator):
+    """
+    :param gt_label: tensor of gt trainIds (incl. ignore_label) of one image, shape (h, w)
+    :return: indices of the sampled pixels (into gt_label.reshape(-1)), the weight of each of them
+    """
+    gt_label = gt_label.reshape(-1)
+    indices = []
+    weights = []
+    for c in range(num_classes):
+        class_indices = torch.nonzero(gt_label == c).squeeze(1)
+        num_pixels = class_indices.shape[0]
+        if num_pixels == 0:
+            continue
+        if num_pixels > pixels_per_class:
+            class_indices = class_indices[torch.randperm(num_pixels, generator=generator)[0:pixels_per_class].to(class_indices.device)]
+        indices.append(class_indices)
+        weights.append(torch.full((class_indices.shape[0], ), num_pixels/class_indices.shape[0], dtype=torch.float64, device=gt_label.device))
+    if len(indices) == 0:
+        return torch.zeros((0, ), dtype=torch.int64, device=gt_label.device), torch.zeros((0, ), dtype=torch.float64, device=gt_label.device)
+    return torch.cat(indices), torch.cat(weights)
+
+def get_interval(values, confidence):
+    return np.percentile(values, 50*(1 - confidence)), np.percentile(values, 50*(1 + confidence))
+
+class FastEvalSink(object):
+    """
+    UncertaintyEngine sink (see utils/inference.py) of the approximate fast
+    evaluation: accumulates the (weighted) confusion matrix and calibration
+    sums of a class-stratified pixel sample of each image, close() prints
+    and returns the estimates with bootstrap confidence intervals.
+
+    :param image_weights: image name -> weight (see get_stratified_subset()), None: all 1
+    :param num_bootstrap: number of bootstrap resamples of the images
+    :param confidence: level of the confidence intervals
+    """
+    def __init__(self, num_classes=19, pixels_per_class=1000, num_bins=15, image_weights=None, num_bootstrap=1000, confidence=0.95, seed=0):
+        self.num_classes = num_classes
+        self.pixels_per_class = pixels_per_class
+        self.image_weights = image_weights
+        self.num_bootstrap = num_bootstrap
+        self.confidence = confidence
+        self.seed = seed
+        self.generator = torch.Generator().manual_seed(seed)
+
+        self.confusion_matrix = ConfusionMatrix(num_classes)
+        self.calibration = CalibrationMetrics(num_classes, num_bins)
+        # (the sums of each image, for the bootstrap:)
+        self.matrices = []
+        self.calibration_sums = []
+        self.num_pixels = 0
+        self.outputs = ["p", "label"]
+
+    def update(self, images, labels, valid_sizes, names, results):
+        if labels is None:
+            return
+        labels = torch.as_tensor(labels).to(results["label"].device).long()
+        for i in range(images.shape[0]):
+            h, w = images.shape[2:4] if valid_sizes is None else valid_sizes[i].tolist()
+            gt_label = labels[i, 0:h, 0:w]
+            indices, weights = sample_pixels(gt_label, self.pixels_per_class, self.num_classes, self.generator)
+            if self.image_weights is not None:
+                weights = weights*self.image_weights[names[i]]
+            ys, xs = indices//w, indices % w
+
+            self.confusion_matrix.update(results["label"][i, ys, xs], gt_label[ys, xs], weights)
+            self.calibration.update(results["p"][i][:, ys, xs].unsqueeze(0), gt_label[ys, xs].unsqueeze(0), weights.unsqueeze(0))
+            self.matrices.append(self.confusion_matrix.matrix.double().cpu().numpy())
+            self.calibration_sums.append(self.calibration.sums.cpu().numpy())
+            self.confusion_matrix.reset()
+            self.calibration.reset()
+            self.num_pixels += indices.shape[0]
+
+    def get_estimates(self, matrix, calibration_sums):
+        self.confusion_matrix.matrix = torch.from_numpy(matrix)
+        self.calibration.sums = torch.from_numpy(calibration_sums)
+        calibration_results = self.calibration.get_results()
+        return {"mean_iou": self.confusion_matrix.get_mean_iou(), "ece": calibration_results["ece"],
+                "nll": calibration_results["nll"], "brier": calibration_results["brier"]}
+
+    def close(self):
+        num_images = len(self.matrices)
+        if num_images == 0:
+            raise Exception("no labeled images were evaluated!")
+        matrices = np.stack(self.matrices) # (shape: (num_images, num_classes*num_classes))
+        calibration_sums = np.stack(self.calibration_sums) # (shape: (num_images, 6, num_classes*num_bins))
+
+        results = self.get_estimates(matrices.sum(axis=0), calibration_sums.sum(axis=0))
+        results["IU_array"] = self.confusion_matrix.get_iou()
+
+        # (each resample is a sum of the per-image sums, with the number of times each image was drawn:)
+        random_state = np.random.RandomState(self.seed)
+        samples = {metric: [] for metric in ["mean_iou", "ece", "nll", "brier"]}
+        for _ in range(self.num_bootstrap):
+            counts = np.bincount(random_state.randint(0, num_images, num_images), minlength=num_images).astype(np.float64)
+            estimates = self.get_estimates(counts.dot(matrices), np.tensordot(counts, calibration_sums, axes=1))
+            for metric in samples:
+                samples[metric].append(estimates[metric])
+        for metric in samples:
+            results[metric + "_interval"] = get_interval(samples[metric], self.confidence)
+        self.confusion_matrix.reset()
+        self.calibration.reset()
+
+        results["num_images"] = num_images
+        results["num_pixels"] = self.num_pixels
+        print ("fast eval (approximate, %d images, %d pixels, %d%% intervals):" % (num_images, self.num_pixels, round(100*self.confidence)))
+        print({'meanIU':results["mean_iou"], 'meanIU_interval':results["mean_iou_interval"], 'IU_array':results["IU_array"]})
+        print({'ECE':results["ece"], 'ECE_interval':results["ece_interval"], 'NLL':results["nll"], 'NLL_interval':results["nll_interval"],
+               'Brier':results["brier"], 'Brier_interval':results["brier_interval"]})
+        return results
@@ -0,0 +1,407 @@
+# code-checked
+# server-checked
+
+# Uncertainty inference shared by the eval scripts: an UncertaintyEngine owns
+# the loaded models, the device and the sampling (M MC-dropout samples of
+# each of N models), and runs a loader through them into output sinks
+# (ImageSink, MetricsSink, UncertaintyStatsSink, ...). The same engine can
+# run any number of datasets/configurations without reloading the models.
+#
+# With a PredictionCache (utils/prediction_cache.py), the sampled logits of
+# each model and image are read from the cache if present, only missing
+# images/models are run.
+#
+# A sink has an "outputs" attribute (the engine outputs it needs, see
+# UncertaintyEngine.predict()), update(images, labels, valid_sizes, names, results)
+# and close() (returns its result).
+#
+# (python -m utils.inference checks the uncertainty outputs on random dropout models)
+
+import hashlib
+import numpy as np
+import cv2
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from utils.batching import get_valid_mask
+from utils.metrics import ConfusionMatrix, CalibrationMetrics, UncertaintyErrorHistogram
+from utils.prediction_cache import get_file_hash, get_image_hash
+from utils.visualization import images_2_bgr, label_imgs_2_color, overlay, values_2_color
+
+def load_models(checkpoint_paths, get_model, num_classes=19, device="cuda"):
+    """
+    :param checkpoint_paths: one checkpoint per (ensemble) model
+    :param get_model: e.g. models.model_mcdropout.get_model
+    :return: list of models in eval mode on device (wrapped in nn.DataParallel on cuda)
+    """
+    models = []
+    for restore_from in checkpoint_paths:
+        deeplab = get_model(num_classes=num_classes)
+        deeplab.load_state_dict(torch.load(restore_from, map_location=device))
+        model = nn.DataParallel(deeplab) if torch.device(device).type == "cuda" else deeplab
+        model.eval()
+        model.to(device)
+        model.checkpoint_path = restore_from # (for get_model_hash())
+        models.append(model)
+    return models
+
+def get_model_hash(model):
+    # (hash of the checkpoint and the model class of a model of load_models())
+    deeplab = model.module if isinstance(model, nn.DataParallel) else model
+    model_hash = hashlib.sha1(get_file_hash(model.checkpoint_path).encode("utf-8"))
+    model_hash.update(("%s.%s" % (type(deeplab).__module__, type(deeplab).__name__)).encode("utf-8"))
+    return model_hash.hexdigest()
+
+def get_sample_seed(seed, model_hash, image_hash):
+    # (seed of the M dropout samples of one model for one image)
+    return int(hashlib.sha1(("%s_%s_%s" % (seed, model_hash, image_hash)).encode("utf-8")).hexdigest()[0:15], 16)
+
+def get_entropy(p, dim=1):
+    return -torch.sum(p*torch.log(torch.clamp(p, min=1e-12)), dim=dim)
+
+def unpack_batch(batch):
+    """
+    :return: (images, labels or None, valid_sizes or None, names) of a batch of
+             any of the datasets ((image, label, size, name), (image, size, name))
+             or of a BucketBatcher ((images, valid_sizes, sizes, names))
+    """
+    if len(batch) == 3:
+        return batch[0], None, None, batch[2]
+    if batch[1].dim() == 2:
+        return batch[0], None, batch[1], batch[3]
+    return batch[0], batch[1], None, batch[3]
+
+class UncertaintyEngine(object):
+    """
+    MC-dropout/ensemble inference: each image gets M samples (forward passes
+    with dropout) of each of the N models, i.e. MC dropout (N = 1), an ensemble
+    (M = 1) or both.
+
+    :param models: list of loaded models (see load_models())
+    :param num_threads: number of torch CPU threads (None: unchanged)
+    :param cache: a PredictionCache (None: always run the models)
+    :param seed: torch seed set at the start of each run() (the dropout masks), part of the cache keys
+    """
+    def __init__(self, models, M=8, num_classes=19, device="cuda", num_threads=None, cache=None, seed=0):
+        self.models = models
+        self.M = M
+        self.num_classes = num_classes
+        self.device = torch.device(device)
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        self.buffers = {}
+        self.cache = cache
+        self.seed = seed
+        if cache is not None:
+            self.model_hashes = [get_model_hash(model) for model in models]
+
+    @property
+    def sampling(self):
+        if len(self.models) == 1:
+            return "mc"
+        return "ensemble" if self.M == 1 else "both"
+
+    def get_buffer(self, name, shape):
+        # (the accumulators are reused between batches of the same shape)
+        if name not in self.buffers or self.buffers[name].shape != shape:
+            self.buffers[name] = torch.empty(shape, device=self.device)
+        return self.buffers[name].zero_()
+
+    def get_logits(self, i, images, image_hashes):
+        """
+        :return: the M sampled logits of model i for images, tensors of shape (batch_size, num_classes, h/8, w/8)
+        """
+        model = self.models[i]
+        if self.cache is None:
+            return (model(images) for j in range(self.M)) # (one sample at a time)
+
+        logits = [self.cache.get(self.model_hashes[i], image_hash, self.M, self.seed) for image_hash in image_hashes]
+        missing = [k for k in range(len(logits)) if logits[k] is None]
+        for k in missing:
+            # (each missing image is run alone, with the dropout seeded by (seed, model, image), and
+            # rounded to float16 like the cached logits, so that the results do not depend on
+            # which images were cache hits or on the batching:)
+            torch.manual_seed(get_sample_seed(self.seed, self.model_hashes[i], image_hashes[k]))
+            logits[k] = torch.cat([model(images[k:(k + 1)]) for j in range(self.M)]).half() # (shape: (M, num_classes, h/8, w/8))
+            self.cache.put(self.model_hashes[i], image_hashes[k], self.M, self.seed, logits[k].cpu().numpy())
+        return torch.stack([torch.as_tensor(sample_logits).to(self.device).float() for sample_logits in logits], dim=1) # (shape: (M, batch_size, num_classes, h/8, w/8))
+
+    def predict(self, images, outputs=("label", "entropy"), image_hashes=None):
+        """
+        :param images: tensor of shape (batch_size, 3, h, w) (normalized, see datasets.py)
+        :param image_hashes: the hash of each image for the cache (None: computed from images)
+        :param outputs: which of the optional outputs to compute ("predictive_entropy", "hentropy", "mutual_information")
+        :return: dict of tensors on device (valid until the next predict()):
+                 "p" (mean of all samples, shape (batch_size, num_classes, h, w)),
+                 "label" (argmax of p), "entropy" (of p for N = 1, otherwise the mean
+                 entropy of the N models (their mean of M samples)), "predictive_entropy"
+                 (entropy of p, also for N > 1), "hentropy" (entropy of the
+                 normalized model entropies, N > 1) and
+                 "mutual_information" (entropy of p - mean entropy of all samples),
+                 all of shape (batch_size, h, w)
+        """
+        if self.cache is not None and image_hashes is None:
+            image_hashes = [get_image_hash(image) for image in images]
+        images = images.to(self.device, non_blocking=True)
+        batch_size, _, h, w = images.shape
+        N = len(self.models)
+        M_float = float(self.M)
+        N_float = float(N)
+
+        p = self.get_buffer("p", (batch_size, self.num_classes, h, w))
+        if N > 1:
+            model_p = self.get_buffer("model_p", (batch_size, self.num_classes, h, w))
+            hp = self.get_buffer("hp", (batch_size, N, h, w))
+        else:
+            model_p = p
+        if "mutual_information" in outputs:
+            mean_sample_entropy = self.get_buffer("mean_sample_entropy", (batch_size, h, w))
+
+        with torch.no_grad():
+            for i in range(N):
+                if N > 1:
+                    model_p.zero_()
+                for j, logits_downsampled in enumerate(self.get_logits(i, images, image_hashes)): # (shape: (batch_size, num_classes, h/8, w/8))
+                    logits = F.interpolate(input=logits_downsampled, size=(h, w), mode='bilinear', align_corners=True) # (shape: (batch_size, num_classes, h, w))
+                    p_value = F.softmax(logits, dim=1) # (shape: (batch_size, num_classes, h, w))
+                    model_p += p_value/M_float
+                    if "mutual_information" in outputs:
+                        mean_sample_entropy += get_entropy(p_value)/(M_float*N_float)
+                if N > 1:
+                    model_p += 1e-6
+                    p += model_p/N_float
+                    hp[:, i] = get_entropy(model_p)/N_float
+
+            results = {"p": p, "label": torch.argmax(p, dim=1)}
+            if N > 1:
+                results["entropy"] = hp.sum(dim=1)
+                if "hentropy" in outputs:
+                    results["hentropy"] = get_entropy(hp)
+                if "predictive_entropy" in outputs or "mutual_information" in outputs:
+                    results["predictive_entropy"] = get_entropy(p)
+            else:
+                results["entropy"] = get_entropy(p)
+                results["predictive_entropy"] = results["entropy"]
+            if "mutual_information" in outputs:
+                results["mutual_information"] = torch.clamp(results["predictive_entropy"] - mean_sample_entropy, min=0)
+        return results
+
+    def run(self, loader, sinks, M=None, max_batches=None):
+        """
+        Runs all batches of loader through the models into the sinks.
+        :param M: number of samples per model for this run (None: self.M)
+        :param max_batches: stop after this many batches (None: all)
+        :return: list of the results of the sinks (their close())
+        """
+        if M is not None:
+            self.M, M = M, self.M
+        outputs = set()
+        for sink in sinks:
+            outputs |= set(sink.outputs)
+        try:
+            num_batches = len(loader)
+        except TypeError:
+            num_batches = None
+        if self.seed is not None:
+            torch.manual_seed(self.seed)
+
+        try:
+            for step, batch in enumerate(loader):
+                if max_batches is not None and step == max_batches:
+                    break
+                if num_batches is None:
+                    print ("%d" % (step+1))
+                else:
+                    print ("%d/%d" % (step+1, num_batches))
+
+                images, labels, valid_sizes, names = unpack_batch(batch)
+                results = self.predict(images, outputs)
+                for sink in sinks:
+                    sink.update(images, labels, valid_sizes, names, results)
+        finally:
+            if M is not None:
+                self.M = M
+        if self.cache is not None:
+            self.cache.report()
+        return [sink.close() for sink in sinks]
+
+class ImageSink(object):
+    """
+    Writes the visualizations of the outputs of writer (an ImageWriter) of up
+    to max_images_per_batch images of each batch (None: all), without padding.
+    """
+    def __init__(self, writer, max_images_per_batch=None, max_entropy=np.log(19)):
+        self.writer = writer
+        self.max_images_per_batch = max_images_per_batch
+        self.max_entropy = max_entropy
+        self.outputs = ["label", "entropy"] + (["hentropy"] if writer.enabled("hentropy") else [])
+        self.names = [] # (of all written images, in order)
+
+    def update(self, images, labels, valid_sizes, names, results):
+        num_images = images.shape[0] if self.max_images_per_batch is None else min(images.shape[0], self.max_images_per_batch)
+        pred_label_imgs_raw = results["label"][0:num_images].cpu().numpy().astype(np.uint8)
+        entropy = results["entropy"][0:num_images].cpu().numpy()
+        if "hentropy" in results:
+            hentropy = results["hentropy"][0:num_images].cpu().numpy()
+
+        for i in range(num_images):
+            h, w = images.shape[2:4] if valid_sizes is None else valid_sizes[i].tolist()
+            img = images_2_bgr(images[i:(i+1), :, 0:h, 0:w].numpy()) # (shape: (1, h, w, 3))
+            self.writer.write(names[i], "img", img[0])
+            if self.writer.enabled("label_overlayed") and labels is not None:
+                self.writer.write(names[i], "label_overlayed", overlay(img, label_imgs_2_color(labels[i:(i+1), 0:h, 0:w].numpy(), bgr=True))[0])
+            if self.writer.enabled("pred_overlayed"):
+                self.writer.write(names[i], "pred_overlayed", overlay(img, label_imgs_2_color(pred_label_imgs_raw[i:(i+1), 0:h, 0:w], bgr=True))[0])
+            if self.writer.enabled("entropy"):
+                self.writer.write(names[i], "entropy", values_2_color(entropy[i:(i+1), 0:h, 0:w], cv2.COLORMAP_HOT, max_value=self.max_entropy)[0])
+            if self.writer.enabled("hentropy") and "hentropy" in results:
+                self.writer.write(names[i], "hentropy", values_2_color(hentropy[i:(i+1), 0:h, 0:w], cv2.COLORMAP_OCEAN)[0])
+            self.names.append(names[i])
+
+    def close(self):
+        self.writer.close()
+        return self.names
+
+class MetricsSink(object):
+    """
+    Accumulates the confusion matrix of the predictions, close() prints and
+    returns the IoU of each class.
+    """
+    def __init__(self, num_classes=19):
+        self.confusion_matrix = ConfusionMatrix(num_classes)
+        self.outputs = ["label"]
+
+    def update(self, images, labels, valid_sizes, names, results):
+        if labels is not None:
+            self.confusion_matrix.update(results["label"], labels)
+
+    def close(self):
+        IU_array = self.confusion_matrix.get_iou()
+        mean_IU = IU_array.mean()
+        print({'meanIU':mean_IU, 'IU_array':IU_array})
+        return IU_array
+
+class CalibrationSink(object):
+    """
+    Accumulates the calibration (ECE, NLL, Brier score, see CalibrationMetrics
+    in utils/metrics.py) of the mean probabilities, close() prints and returns them.
+    """
+    def __init__(self, num_classes=19, num_bins=15):
+        self.calibration = CalibrationMetrics(num_classes, num_bins)
+        self.outputs = ["p"]
+
+    def update(self, images, labels, valid_sizes, names, results):
+        if labels is not None:
+            self.calibration.update(results["p"], labels)
+
+    def close(self):
+        results = self.calibration.get_results()
+        print({'ECE':results["ece"], 'NLL':results["nll"], 'Brier':results["brier"], 'class_ECE':results["class_ece"]})
+        return results
+
+class UncertaintyErrorSink(object):
+    """
+    Measures how well each uncertainty output flags the misclassified pixels
+    (AUROC, AUPR, sparsification, see UncertaintyErrorHistogram in utils/metrics.py).
+    :param max_values: output -> max value of its histogram, e.g. {"entropy": np.log(num_classes)}
+    """
+    def __init__(self, max_values, num_bins=10000):
+        self.histograms = {output: UncertaintyErrorHistogram(num_bins, max_value) for output, max_value in max_values.items()}
+        self.outputs = ["label"] + list(max_values.keys())
+
+    def update(self, images, labels, valid_sizes, names, results):
+        if labels is not None:
+            for output, histogram in self.histograms.items():
+                histogram.update(results[output], results["label"], labels)
+
+    def close(self):
+        results = {output: histogram.get_results() for output, histogram in self.histograms.items()}
+        for output, output_results in results.items():
+            print({'score':output, 'AUROC':output_results["auroc"], 'AUPR':output_results["aupr"], 'AUSE':output_results["ause"]})
+        return results
+
+class UncertaintyStatsSink(object):
+    """
+    Mean of the uncertainty outputs (e.g. "entropy", "mutual_information") over
+    all pixels, the padding of BucketBatcher batches excluded.
+    """
+    def __init__(self, outputs=("entropy", )):
+        self.outputs = list(outputs)
+        self.sums = {output: 0.0 for output in self.outputs}
+        self.num_pixels = 0
+        self.num_images = 0
+
+    def update(self, images, labels, valid_sizes, names, results):
+        batch_size, _, h, w = images.shape
+        if valid_sizes is None:
+            valid_mask = None
+            self.num_pixels += batch_size*h*w
+        else:
+            valid_mask = get_valid_mask(valid_sizes.to(results["label"].device), h, w) # (shape: (batch_size, h, w))
+            self.num_pixels += valid_mask.sum().item()
+        for output in self.outputs:
+            values = results[output] if valid_mask is None else results[output][valid_mask]
+            self.sums[output] += values.sum().item()
+        self.num_images += batch_size
+
+    def close(self):
+        stats = {"num_images": self.num_images}
+        for output in self.outputs:
+            stats["mean_" + output] = self.sums[output]/max(1, self.num_pixels)
+        print (stats)
+        return stats
+
+def write_video(video_path, image_path, names, rows, fps=20, repeat=1):
+    """
+    Assembles the images written by an ImageSink (image_path/<name>_<type>.png)
+    into a video, one frame per name (in the given order, written repeat times).
+    :param rows: the output types of each row of a frame, e.g. [["img"], ["pred_overlayed", "entropy"]],
+                 rows with fewer images are centered
+    """
+    out = None
+    for step, name in enumerate(names):
+        if step % 10 == 0:
+            print ("step: %d/%d" % (step+1, len(names)))
+
+        imgs = [[cv2.imread(image_path + "/" + name + "_" + output_type + ".png", -1) for output_type in row] for row in rows]
+        h, w = imgs[0][0].shape[0:2]
+        num_cols = max(len(row) for row in rows)
+
+        combined_img = np.zeros((len(rows)*h, num_cols*w, 3), dtype=np.uint8)
+        for row, row_imgs in enumerate(imgs):
+            offset = int(0.5*(num_cols - len(row_imgs))*w)
+            for col, img in enumerate(row_imgs):
+                combined_img[(row*h):((row+1)*h), (offset + col*w):(offset + (col+1)*w)] = img
+
+        if out is None:
+            out = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (num_cols*w, len(rows)*h))
+        for i in range(repeat):
+            out.write(combined_img)
+
+    if out is not None:
+        out.release()
+
+if __name__ == "__main__":
+    class DropoutModel(nn.Module):
+        # (stochastic dummy model with the output stride of the real models)
+        def __init__(self, num_classes):
+            super(DropoutModel, self).__init__()
+            self.conv = nn.Conv2d(3, num_classes, kernel_size=8, stride=8)
+
+        def forward(self, x):
+            return self.conv(F.dropout(x, p=0.5, training=True))
+
+    num_classes = 19
+    torch.manual_seed(0)
+    images = 50*torch.randn(2, 3, 64, 96)
+    for N in [1, 4]:
+        engine = UncertaintyEngine([DropoutModel(num_classes) for i in range(N)], M=8, num_classes=num_classes, device="cpu")
+        results = engine.predict(images, outputs=("label", "predictive_entropy", "mutual_information"))
+        predictive_entropy = results["predictive_entropy"]
+        assert torch.allclose(predictive_entropy, get_entropy(results["p"]))
+        mutual_information = results["mutual_information"]
+        # (the mutual information is the predictive entropy minus the (non-negative) mean sample entropy:)
+        assert mutual_information.min() >= 0, "negative mutual information"
+        assert (mutual_information <= predictive_entropy + 1e-4).all(), "mutual information > predictive entropy"
+        print ("N: %d, mean predictive entropy: %.4f, mean mutual information: %.4f" % (N, predictive_entropy.mean().item(), mutual_information.mean().item()))
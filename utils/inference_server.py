@@ -0,0 +1,196 @@
+# code-checked
+# server-checked
+
+# (usage, from the repository root: python -m utils.inference_server)
+#
+# Local inference service that keeps an UncertaintyEngine (utils/inference.py,
+# the MC-dropout model or an ensemble of them) loaded and answers HTTP requests
+# on localhost:
+#   POST /predict (body: an encoded image, any format readable by OpenCV)
+#       -> .npz with "label" (uint8, shape (h, w)), "entropy" (of the mean
+#          prediction, also for an ensemble) and "mutual_information" (float16, shape (h, w))
+#   GET /status -> JSON (models, M, number of requests/batches so far)
+# The requests are queued and run in batches of up to max_batch_size images
+# of the same size bucket (see utils/batching.py). A batch waits at most
+# max_wait seconds after its first request for more requests.
+# (client: request_prediction())
+
+import io
+import json
+import time
+import threading
+import queue
+import collections
+import urllib.request
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import cv2
+import torch
+
+from utils.batching import get_bucket, pad_images, strip_padding
+from utils.inference import UncertaintyEngine, load_models
+
+class InferenceServer(object):
+    """
+    Runs the queued predict() requests in dynamic batches through engine (an
+    UncertaintyEngine), in one worker thread.
+
+    :param max_wait: max time (in seconds) a batch waits for more requests after its first one
+    :param max_pixels: max number of (padded) pixels per batch
+    """
+    def __init__(self, engine, max_batch_size=4, max_wait=0.01, bucket_size=64, max_pixels=4*1024*2048):
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.bucket_size = bucket_size
+        self.max_pixels = max_pixels
+
+        self.requests = queue.Queue()
+        self.num_requests = 0
+        self.num_batches = 0
+
+        self.worker = threading.Thread(target=self._worker_loop, name="InferenceServer")
+        self.worker.daemon = True
+        self.worker.start()
+
+    def predict(self, image):
+        """
+        :param image: uint8 BGR image of shape (h, w, 3), e.g. from cv2.imread()
+        :return: Future of a dict with "label", "entropy" and "mutual_information"
+        """
+        image = np.asarray(image, np.float32)
+
+        mean = (102.9801, 115.9465, 122.7717)
+        image = image[:,:,::-1]
+        image -= mean
+
+        image = image.transpose((2, 0, 1))
+
+        future = Future()
+        self.requests.put((torch.from_numpy(image.copy()), future))
+        return future
+
+    def run_batch(self, images):
+        images, valid_sizes = pad_images(images, get_bucket(images[0].shape[1], images[0].shape[2], self.bucket_size))
+        results = self.engine.predict(images, outputs=("label", "predictive_entropy", "mutual_information"))
+
+        # (the padding is cropped from the results:)
+        label = strip_padding(results["label"].cpu().numpy().astype(np.uint8), valid_sizes)
+        entropy = strip_padding(results["predictive_entropy"].cpu().numpy().astype(np.float16), valid_sizes)
+        mutual_information = strip_padding(results["mutual_information"].cpu().numpy().astype(np.float16), valid_sizes)
+        return [{"label": label[i], "entropy": entropy[i], "mutual_information": mutual_information[i]} for i in range(len(label))]
+
+    def _worker_loop(self):
+        while True:
+            requests = [self.requests.get()]
+            deadline = time.time() + self.max_wait
+            while len(requests) < self.max_batch_size:
+                try:
+                    requests.append(self.requests.get(timeout=max(0.0, deadline - time.time())))
+                except queue.Empty:
+                    break
+
+            buckets = collections.OrderedDict()
+            for image, future in requests:
+                buckets.setdefault(get_bucket(image.shape[1], image.shape[2], self.bucket_size), []).append((image, future))
+            for bucket, bucket_requests in buckets.items():
+                batch_size = max(1, self.max_pixels//(bucket[0]*bucket[1]))
+                for start in range(0, len(bucket_requests), batch_size):
+                    batch_requests = bucket_requests[start:(start + batch_size)]
+                    try:
+                        results = self.run_batch([image for image, _ in batch_requests])
+                    except Exception as e:
+                        for _, future in batch_requests:
+                            future.set_exception(e)
+                        continue
+                    self.num_requests += len(batch_requests)
+                    self.num_batches += 1
+                    for (_, future), result in zip(batch_requests, results):
+                        future.set_result(result)
+
+    def status(self):
+        return {"num_models": len(self.engine.models), "M": self.engine.M, "sampling": self.engine.sampling, "device": str(self.engine.device),
+                "queued": self.requests.qsize(),
+                "num_requests": self.num_requests, "num_batches": self.num_batches}
+
+class RequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != "/predict":
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        image = cv2.imdecode(np.frombuffer(body, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            self.send_error(400, "could not decode the image")
+            return
+
+        start_time = time.time()
+        try:
+            result = self.server.inference.predict(image).result()
+        except Exception as e:
+            self.send_error(500, str(e))
+            return
+        output = io.BytesIO()
+        np.savez(output, **result)
+        self.send_data(output.getvalue(), "application/octet-stream", {"X-Inference-Time": "%.4f" % (time.time() - start_time)})
+
+    def do_GET(self):
+        if self.path != "/status":
+            self.send_error(404)
+            return
+        self.send_data(json.dumps(self.server.inference.status()).encode("utf-8"), "application/json")
+
+    def send_data(self, data, content_type, headers={}):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass # (no line per request)
+
+def serve(inference, host="127.0.0.1", port=8000):
+    """
+    :return: the (not yet started) HTTP server of inference, call serve_forever()
+    """
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    server.inference = inference
+    return server
+
+def request_prediction(image, url="http://127.0.0.1:8000"):
+    """
+    :param image: path of an image file, or its encoded bytes
+    :return: dict with "label", "entropy" and "mutual_information" (see InferenceServer)
+    """
+    if isinstance(image, str):
+        with open(image, "rb") as file:
+            image = file.read()
+    request = urllib.request.Request(url + "/predict", data=image, headers={"Content-Type": "application/octet-stream"})
+    with urllib.request.urlopen(request) as response:
+        result = np.load(io.BytesIO(response.read()))
+        return {key: result[key] for key in result.files}
+
+if __name__ == "__main__":
+    from models.model_mcdropout import get_model
+
+    model_id = "mcdropout"
+    model_is = [0] # (one MC-dropout model, [0, 1, 2, 3]: an ensemble of four)
+    M = 8
+    num_classes = 19
+    host = "127.0.0.1"
+    port = 8000
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    models = load_models(["./trained_models/%s_%d/checkpoint_20000.pth" % (model_id, i) for i in model_is], get_model, num_classes=num_classes, device=device)
+    inference = InferenceServer(UncertaintyEngine(models, M=M, num_classes=num_classes, device=device))
+    inference.predict(np.zeros((64, 64, 3), dtype=np.uint8)).result() # (warm-up)
+
+    server = serve(inference, host, port)
+    print ("serving %d model(s), M: %d, on http://%s:%d" % (len(models), M, host, port))
+    server.serve_forever()
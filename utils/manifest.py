@@ -0,0 +1,162 @@
+# code-checked
+# server-checked
+
+# Checks the image/label files of a dataset once (in parallel threads, which
+# mostly wait for stat/open on network storage) and caches the result:
+#   manifest_dir/<name>_<hash of all paths>.pkl
+# Missing and corrupt (empty, unreadable header, truncated PNG, image/label
+# size mismatch) examples are dropped and reported, the valid examples get
+# their resolved label file (see get_label_file()) and their image size
+# ("height", "width"). The cached manifest is checked again when a directory
+# of the images/labels has changed (its mtime changes when files are added,
+# removed or replaced, e.g. by utils/convert_labels.py or when a missing image
+# is restored), use refresh=True after modifying files in place.
+
+import os
+import os.path as osp
+import time
+import struct
+import pickle
+import hashlib
+import cv2
+from multiprocessing.pool import ThreadPool
+
+manifest_dir = "./manifests"
+
+png_signature = b"\x89PNG\r\n\x1a\n"
+png_end = b"IEND\xaeB`\x82"
+
+def read_image_size(path):
+    """
+    Reads the size of an image from its header (PNG, JPEG), other formats are decoded.
+    :return: (h, w), raises FileNotFoundError if the file is missing, OSError/ValueError if it is corrupt
+    """
+    with open(path, "rb") as file:
+        header = file.read(26)
+        if header[0:8] == png_signature:
+            if header[12:16] != b"IHDR":
+                raise ValueError("no PNG IHDR chunk")
+            w, h = struct.unpack(">II", header[16:24])
+            file.seek(-12, os.SEEK_END)
+            if file.read(12)[4:] != png_end: # (the last chunk of a complete PNG)
+                raise ValueError("truncated PNG")
+            return h, w
+
+        if header[0:2] == b"\xff\xd8": # (JPEG: the size is in the first SOF marker)
+            file.seek(2)
+            while True:
+                marker = file.read(4)
+                if len(marker) < 4 or marker[0] != 0xff:
+                    raise ValueError("no JPEG SOF marker")
+                marker_type, length = marker[1], struct.unpack(">H", marker[2:4])[0]
+                if marker_type in (0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf):
+                    h, w = struct.unpack(">HH", file.read(5)[1:5])
+                    return h, w
+                file.seek(length - 2, os.SEEK_CUR)
+
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError("could not decode")
+    return image.shape[0:2]
+
+def get_trainId_label_path(label_path):
+    # (path of the pre-converted trainId label file, see utils/convert_labels.py)
+    if label_path.endswith("_labelIds.png"): # (Cityscapes)
+        return label_path[:-len("_labelIds.png")] + "_labelTrainIds.png"
+    return osp.splitext(label_path)[0] + "_trainIds.png"
+
+def get_label_file(label_path, cache=None):
+    # (returns the pre-converted trainId label file if it exists, otherwise label_path)
+    if cache is not None and label_path in cache:
+        return cache[label_path]
+    trainId_label_path = get_trainId_label_path(label_path)
+    if osp.exists(trainId_label_path):
+        label_file = (trainId_label_path, True)
+    else:
+        label_file = (label_path, False)
+    if cache is not None:
+        cache[label_path] = label_file
+    return label_file
+
+def check_example(datafiles):
+    """
+    :return: (datafiles with "label", "label_is_trainId", "height" and "width", None)
+             or (None, (path, reason))
+    """
+    datafiles = dict(datafiles)
+    paths = [datafiles["img"]]
+    if datafiles.get("label") is not None:
+        datafiles["label"], datafiles["label_is_trainId"] = get_label_file(datafiles["label"])
+        paths.append(datafiles["label"])
+
+    sizes = []
+    for path in paths:
+        try:
+            sizes.append(read_image_size(path))
+        except FileNotFoundError:
+            return None, (path, "missing")
+        except (OSError, ValueError, struct.error) as e:
+            return None, (path, "corrupt (%s)" % e)
+    if len(sizes) == 2 and sizes[0] != sizes[1]:
+        return None, (paths[1], "corrupt (size %s, image size %s)" % (sizes[1], sizes[0]))
+
+    datafiles["height"], datafiles["width"] = sizes[0]
+    return datafiles, None
+
+def get_dir_mtimes(files):
+    # (mtime of each directory of the image/label files, None if it does not exist)
+    dirs = set()
+    for datafiles in files:
+        dirs.add(osp.dirname(datafiles["img"]))
+        if datafiles.get("label") is not None:
+            dirs.add(osp.dirname(datafiles["label"]))
+    dir_mtimes = {}
+    for dir_path in sorted(dirs):
+        try:
+            dir_mtimes[dir_path] = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            dir_mtimes[dir_path] = None
+    return dir_mtimes
+
+def get_manifest(files, name, num_workers=32, refresh=False):
+    """
+    :param files: list of dicts with "img", optionally "label" (the label ids file) and any other keys
+    :param name: name of the cached manifest
+    :param refresh: check all files again, even if a cached manifest exists
+    :return: list of the valid examples (in order)
+    """
+    paths_hash = hashlib.md5()
+    for datafiles in files:
+        paths_hash.update(("%s\n%s\n" % (datafiles["img"], datafiles.get("label"))).encode("utf-8"))
+    manifest_path = manifest_dir + "/%s_%s.pkl" % (name, paths_hash.hexdigest()[0:12])
+    dir_mtimes = get_dir_mtimes(files)
+
+    if os.path.exists(manifest_path) and not refresh:
+        with open(manifest_path, "rb") as file:
+            manifest = pickle.load(file)
+        if manifest.get("dir_mtimes") == dir_mtimes:
+            print ("manifest %s: %d valid, %d invalid examples (cached, %s)" % (name, len(manifest["valid"]), len(manifest["invalid"]), manifest_path))
+            return manifest["valid"]
+        print ("manifest %s: the files have changed, checking them again" % name)
+
+    start_time = time.time()
+    pool = ThreadPool(num_workers)
+    results = pool.map(check_example, files, chunksize=16)
+    pool.close()
+
+    manifest = {"valid": [datafiles for datafiles, _ in results if datafiles is not None],
+                "invalid": [invalid for _, invalid in results if invalid is not None],
+                "dir_mtimes": dir_mtimes}
+    print ("manifest %s: %d valid, %d invalid examples (checked in %.1f s)" % (name, len(manifest["valid"]), len(manifest["invalid"]), time.time() - start_time))
+    for path, reason in manifest["invalid"][0:20]:
+        print ("    %s: %s" % (path, reason))
+    if len(manifest["invalid"]) > 20:
+        print ("    ...")
+
+    if not os.path.exists(manifest_dir):
+        os.makedirs(manifest_dir)
+    with open(manifest_path + ".tmp", "wb") as file:
+        pickle.dump(manifest, file)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    return manifest["valid"]
@@ -0,0 +1,307 @@
+# code-checked
+# server-checked
+
+import numpy as np
+import torch
+import torch.distributed as dist
+
+class ConfusionMatrix(object):
+    """
+    Accumulates the confusion matrix (rows: gt, cols: pred) of a segmentation
+    model with a single bincount of length num_classes*num_classes per update,
+    on the device of the given tensors.
+
+    :param num_classes: the number of classes
+    :param ignore_label: gt value of pixels that are not evaluated
+    """
+    def __init__(self, num_classes, ignore_label=255):
+        self.num_classes = num_classes
+        self.ignore_label = ignore_label
+        self.matrix = None # (int64 tensor of shape (num_classes*num_classes, ), allocated on the first update)
+
+    def update(self, pred_label, gt_label, weights=None):
+        """
+        :param pred_label: tensor of predicted trainIds, shape (batch_size, h, w)
+        :param gt_label: tensor of gt trainIds (incl. ignore_label), same shape
+        :param weights: tensor of pixel weights, same shape (e.g. inverse sampling
+                        probabilities, the matrix then holds float64 sums), None: counts
+        """
+        pred_label = torch.as_tensor(pred_label)
+        gt_label = torch.as_tensor(gt_label).to(pred_label.device)
+
+        gt_label = gt_label.reshape(-1).long()
+        pred_label = pred_label.reshape(-1).long()
+        valid = (gt_label != self.ignore_label) & (gt_label >= 0) & (gt_label < self.num_classes)
+        index = gt_label[valid]*self.num_classes + pred_label[valid]
+        if weights is None:
+            counts = torch.bincount(index, minlength=self.num_classes*self.num_classes)
+        else:
+            weights = torch.as_tensor(weights).to(pred_label.device).reshape(-1)[valid].double()
+            counts = torch.bincount(index, weights=weights, minlength=self.num_classes*self.num_classes)
+
+        if self.matrix is None:
+            self.matrix = counts
+        else:
+            self.matrix = self.matrix + counts.to(self.matrix.device)
+
+    def merge(self, other):
+        """
+        Adds the counts of another ConfusionMatrix (e.g. from another worker).
+        """
+        if other.num_classes != self.num_classes:
+            raise Exception("cannot merge confusion matrices with different num_classes!")
+        if other.matrix is not None:
+            if self.matrix is None:
+                self.matrix = other.matrix.clone()
+            else:
+                self.matrix = self.matrix + other.matrix.to(self.matrix.device)
+        return self
+
+    def all_reduce(self, device=None):
+        """
+        Sums the counts over all processes of the default torch.distributed group.
+        """
+        if self.matrix is None:
+            self.matrix = torch.zeros(self.num_classes*self.num_classes, dtype=torch.int64, device=device)
+        if dist.is_available() and dist.is_initialized():
+            dist.all_reduce(self.matrix)
+        return self
+
+    def reset(self):
+        self.matrix = None
+
+    def get_confusion_matrix(self):
+        """
+        :return: float64 array of shape (num_classes, num_classes)
+        """
+        if self.matrix is None:
+            return np.zeros((self.num_classes, self.num_classes))
+        return self.matrix.cpu().numpy().reshape(self.num_classes, self.num_classes).astype(np.float64)
+
+    def get_iou(self):
+        """
+        :return: the IoU of each class, array of shape (num_classes, )
+        """
+        confusion_matrix = self.get_confusion_matrix()
+        pos = confusion_matrix.sum(1)
+        res = confusion_matrix.sum(0)
+        tp = np.diag(confusion_matrix)
+        return tp / np.maximum(1.0, pos + res - tp)
+
+    def get_mean_iou(self):
+        return self.get_iou().mean()
+
+class CalibrationMetrics(object):
+    """
+    Accumulates the calibration of predicted class probabilities over any
+    number of pixels in fixed memory, on the device of the given tensors:
+    reliability bins of the confidence (max probability) per predicted class
+    (-> ECE), and the negative log-likelihood and Brier score per gt class.
+
+    :param num_bins: number of equal-width confidence bins in [0, 1]
+    :param ignore_label: gt value of pixels that are not evaluated
+    """
+    def __init__(self, num_classes, num_bins=15, ignore_label=255):
+        self.num_classes = num_classes
+        self.num_bins = num_bins
+        self.ignore_label = ignore_label
+        self.sums = None # (float64 tensor of shape (6, num_classes*num_bins), allocated on the first update)
+
+    def update(self, p, gt_label, weights=None):
+        """
+        :param p: tensor of predicted class probabilities, shape (batch_size, num_classes, h, w)
+        :param gt_label: tensor of gt trainIds (incl. ignore_label), shape (batch_size, h, w)
+        :param weights: tensor of pixel weights, shape (batch_size, h, w) (None: all 1)
+        """
+        p = torch.as_tensor(p)
+        gt_label = torch.as_tensor(gt_label).to(p.device).long()
+        valid = (gt_label != self.ignore_label) & (gt_label >= 0) & (gt_label < self.num_classes)
+
+        confidence, pred_label = torch.max(p, dim=1) # (shape: (batch_size, h, w))
+        p_gt = torch.gather(p, 1, torch.clamp(gt_label, 0, self.num_classes - 1).unsqueeze(1)).squeeze(1) # (shape: (batch_size, h, w))
+        sum_of_squares = torch.sum(p*p, dim=1) # (shape: (batch_size, h, w))
+
+        confidence = confidence[valid].double()
+        pred_label = pred_label[valid]
+        gt_label = gt_label[valid]
+        p_gt = p_gt[valid].double()
+        sum_of_squares = sum_of_squares[valid].double()
+        if weights is None:
+            weights = torch.ones_like(confidence)
+        else:
+            weights = torch.as_tensor(weights).to(p.device)[valid].double()
+
+        bins = torch.clamp((confidence*self.num_bins).long(), max=self.num_bins - 1)
+        bin_index = pred_label*self.num_bins + bins
+        length = self.num_classes*self.num_bins
+        sums = torch.stack([
+            torch.bincount(bin_index, weights=weights, minlength=length), # (pixels per (predicted class, bin))
+            torch.bincount(bin_index, weights=weights*confidence, minlength=length),
+            torch.bincount(bin_index, weights=weights*(pred_label == gt_label).double(), minlength=length),
+            # (per gt class, in the first num_classes entries:)
+            torch.bincount(gt_label, weights=weights, minlength=length),
+            torch.bincount(gt_label, weights=weights*-torch.log(torch.clamp(p_gt, min=1e-12)), minlength=length),
+            torch.bincount(gt_label, weights=weights*(sum_of_squares - 2*p_gt + 1), minlength=length), # (sum_c (p_c - onehot_c)^2)
+        ])
+
+        if self.sums is None:
+            self.sums = sums
+        else:
+            self.sums += sums.to(self.sums.device)
+
+    def merge(self, other):
+        """
+        Adds the sums of another CalibrationMetrics (e.g. from another worker).
+        """
+        if other.num_classes != self.num_classes or other.num_bins != self.num_bins:
+            raise Exception("cannot merge calibration metrics with different num_classes/num_bins!")
+        if other.sums is not None:
+            if self.sums is None:
+                self.sums = other.sums.clone()
+            else:
+                self.sums += other.sums.to(self.sums.device)
+        return self
+
+    def all_reduce(self, device=None):
+        """
+        Sums over all processes of the default torch.distributed group.
+        """
+        if self.sums is None:
+            self.sums = torch.zeros((6, self.num_classes*self.num_bins), dtype=torch.float64, device=device)
+        if dist.is_available() and dist.is_initialized():
+            dist.all_reduce(self.sums)
+        return self
+
+    def reset(self):
+        self.sums = None
+
+    def get_results(self):
+        """
+        :return: dict with "ece", "nll", "brier", "accuracy" (over all pixels),
+                 "reliability" (array of shape (num_bins, 3): pixels, mean confidence, accuracy of each bin),
+                 "class_ece" (per predicted class), "class_nll", "class_brier" (per gt class)
+        """
+        if self.sums is None:
+            sums = np.zeros((6, self.num_classes*self.num_bins))
+        else:
+            sums = self.sums.cpu().numpy()
+        counts, confidences, corrects = [sums[i].reshape(self.num_classes, self.num_bins) for i in range(3)]
+        class_counts, class_nlls, class_briers = [sums[i][0:self.num_classes] for i in range(3, 6)]
+
+        def get_ece(counts, confidences, corrects):
+            return np.abs(confidences - corrects).sum(axis=-1)/np.maximum(1.0, counts.sum(axis=-1))
+
+        bin_counts = counts.sum(axis=0)
+        num_pixels = max(1.0, class_counts.sum())
+        return {"ece": get_ece(bin_counts, confidences.sum(axis=0), corrects.sum(axis=0)),
+                "nll": class_nlls.sum()/num_pixels,
+                "brier": class_briers.sum()/num_pixels,
+                "accuracy": corrects.sum()/num_pixels,
+                "reliability": np.stack([bin_counts, confidences.sum(axis=0)/np.maximum(1.0, bin_counts), corrects.sum(axis=0)/np.maximum(1.0, bin_counts)], axis=1),
+                "class_ece": get_ece(counts, confidences, corrects),
+                "class_nll": class_nlls/np.maximum(1.0, class_counts),
+                "class_brier": class_briers/np.maximum(1.0, class_counts)}
+
+class UncertaintyErrorHistogram(object):
+    """
+    Measures how well an uncertainty score (e.g. entropy) flags misclassified
+    pixels, from histograms of the score of the correct and of the incorrect
+    pixels (num_bins bins in [0, max_value], larger values in the last bin),
+    in fixed memory on the device of the given tensors. The AUROC/AUPR (errors
+    as positives) and sparsification curves are exact up to the pixels in the
+    same bin, whose order is unknown (see "auroc_error_bound").
+
+    :param ignore_label: gt value of pixels that are not evaluated
+    """
+    def __init__(self, num_bins=10000, max_value=1.0, ignore_label=255):
+        self.num_bins = num_bins
+        self.max_value = max_value
+        self.ignore_label = ignore_label
+        self.counts = None # (int64 tensor of shape (2*num_bins, ): correct, incorrect pixels per bin, allocated on the first update)
+
+    def update(self, scores, pred_label, gt_label):
+        """
+        :param scores: tensor of uncertainty scores, shape (batch_size, h, w)
+        :param pred_label: tensor of predicted trainIds, same shape
+        :param gt_label: tensor of gt trainIds (incl. ignore_label), same shape
+        """
+        scores = torch.as_tensor(scores)
+        pred_label = torch.as_tensor(pred_label).to(scores.device)
+        gt_label = torch.as_tensor(gt_label).to(scores.device).long()
+        valid = (gt_label != self.ignore_label) & (gt_label >= 0)
+
+        bins = torch.clamp((scores[valid].float()*(self.num_bins/self.max_value)).long(), 0, self.num_bins - 1)
+        incorrect = (pred_label[valid].long() != gt_label[valid]).long()
+        counts = torch.bincount(incorrect*self.num_bins + bins, minlength=2*self.num_bins)
+
+        if self.counts is None:
+            self.counts = counts
+        else:
+            self.counts += counts.to(self.counts.device)
+
+    def merge(self, other):
+        """
+        Adds the counts of another UncertaintyErrorHistogram (e.g. from another worker).
+        """
+        if other.num_bins != self.num_bins or other.max_value != self.max_value:
+            raise Exception("cannot merge histograms with different num_bins/max_value!")
+        if other.counts is not None:
+            if self.counts is None:
+                self.counts = other.counts.clone()
+            else:
+                self.counts += other.counts.to(self.counts.device)
+        return self
+
+    def all_reduce(self, device=None):
+        """
+        Sums the counts over all processes of the default torch.distributed group.
+        """
+        if self.counts is None:
+            self.counts = torch.zeros(2*self.num_bins, dtype=torch.int64, device=device)
+        if dist.is_available() and dist.is_initialized():
+            dist.all_reduce(self.counts)
+        return self
+
+    def reset(self):
+        self.counts = None
+
+    def get_results(self, num_fractions=100):
+        """
+        :param num_fractions: number of steps of the sparsification curves
+        :return: dict with "auroc", "auroc_error_bound" (max deviation from the exact AUROC),
+                 "aupr" (average precision), "error_rate", "fractions" (of removed pixels,
+                 array of shape (num_fractions+1, )), "sparsification" (error rate of the
+                 remaining pixels after removing the most uncertain ones), "oracle" (after
+                 removing the errors first) and "ause" (area between the two curves)
+        """
+        if self.counts is None:
+            counts = np.zeros((2, self.num_bins))
+        else:
+            counts = self.counts.cpu().numpy().reshape(2, self.num_bins).astype(np.float64)
+        # (from the most to the least uncertain bin:)
+        correct, incorrect = counts[0, ::-1], counts[1, ::-1]
+        num_correct, num_incorrect = max(1.0, correct.sum()), max(1.0, incorrect.sum())
+        num_pixels = correct.sum() + incorrect.sum()
+
+        tpr = np.concatenate([[0.0], np.cumsum(incorrect)/num_incorrect])
+        fpr = np.concatenate([[0.0], np.cumsum(correct)/num_correct])
+        auroc = np.sum((fpr[1:] - fpr[:-1])*(tpr[1:] + tpr[:-1])/2) # (ties within a bin count half)
+        auroc_error_bound = 0.5*np.sum(correct*incorrect)/(num_correct*num_incorrect)
+
+        cum_incorrect = np.cumsum(incorrect)
+        precision = cum_incorrect/np.maximum(1.0, np.cumsum(correct + incorrect))
+        aupr = np.sum(incorrect/num_incorrect*precision)
+
+        # (the pixels of a partially removed bin are assumed to be uniformly correct/incorrect:)
+        fractions = np.linspace(0.0, 1.0, num_fractions + 1)
+        num_removed = fractions*num_pixels
+        removed_incorrect = np.interp(num_removed, np.concatenate([[0.0], np.cumsum(correct + incorrect)]), np.concatenate([[0.0], cum_incorrect]))
+        num_remaining = np.maximum(1.0, num_pixels - num_removed)
+        sparsification = np.maximum(0.0, incorrect.sum() - removed_incorrect)/num_remaining
+        oracle = np.maximum(0.0, incorrect.sum() - num_removed)/num_remaining
+        sparsification[-1] = oracle[-1] = 0.0
+        ause = np.sum((fractions[1:] - fractions[:-1])*((sparsification - oracle)[1:] + (sparsification - oracle)[:-1])/2)
+
+        return {"auroc": auroc, "auroc_error_bound": auroc_error_bound, "aupr": aupr,
+                "error_rate": incorrect.sum()/max(1.0, num_pixels), "fractions": fractions,
+                "sparsification": sparsification, "oracle": oracle, "ause": ause}
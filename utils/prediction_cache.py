@@ -0,0 +1,71 @@
+# code-checked
+# server-checked
+
+# Content-addressed cache of the model outputs of UncertaintyEngine (see
+# utils/inference.py), so that re-running an evaluation (e.g. for another
+# metric or visualization) only runs the models on new images/checkpoints:
+#   cache_path/<model hash>/<image hash[0:2]>/<image hash>_M<M>_seed<seed>.npy
+# Each entry holds the M sampled logits of one model for one image at the
+# output resolution of the model (float16, shape (M, num_classes, h/8, w/8)),
+# from which the mean probabilities and all per-model statistics are
+# recomputed exactly. The model hash covers the checkpoint file and the model
+# class, the image hash the normalized image. Delete cache_path to clear it.
+#
+# An entry of a 1024x2048 Cityscapes image takes M*19*128*256*2 bytes (~10 MB
+# for M = 8), i.e. ~5 GB for the 500 val images and each model. There is no
+# eviction, the cache grows with every new image/checkpoint/M/seed.
+
+import os
+import hashlib
+import numpy as np
+import torch
+
+def get_file_hash(path, chunk_size=16*1024*1024):
+    file_hash = hashlib.sha1()
+    with open(path, "rb") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if len(chunk) == 0:
+                break
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def get_image_hash(image):
+    """
+    :param image: tensor/array of shape (3, h, w)
+    """
+    image = np.ascontiguousarray(torch.as_tensor(image).cpu().numpy())
+    image_hash = hashlib.sha1(str(image.shape).encode("utf-8"))
+    image_hash.update(image.data)
+    return image_hash.hexdigest()
+
+class PredictionCache(object):
+    def __init__(self, cache_path="./prediction_cache"):
+        self.cache_path = cache_path
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def path(self, model_hash, image_hash, M, seed):
+        return "%s/%s/%s/%s_M%d_seed%s.npy" % (self.cache_path, model_hash[0:16], image_hash[0:2], image_hash, M, seed)
+
+    def get(self, model_hash, image_hash, M, seed):
+        """
+        :return: float16 array of shape (M, num_classes, h/8, w/8), or None if not cached
+        """
+        path = self.path(model_hash, image_hash, M, seed)
+        if not os.path.exists(path):
+            self.num_misses += 1
+            return None
+        self.num_hits += 1
+        return np.load(path)
+
+    def put(self, model_hash, image_hash, M, seed, logits):
+        path = self.path(model_hash, image_hash, M, seed)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as file:
+            np.save(file, np.asarray(logits, dtype=np.float16))
+        os.replace(path + ".tmp", path)
+
+    def report(self):
+        print ("prediction cache %s: %d hits, %d misses" % (self.cache_path, self.num_hits, self.num_misses))
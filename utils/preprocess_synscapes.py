@@ -7,6 +7,7 @@ import cv2
 import os
 from collections import namedtuple
 import random
+from multiprocessing import Pool
 
 # (NOTE! this is taken from the official Cityscapes scripts:)
 Label = namedtuple( 'Label' , [
@@ -85,19 +86,17 @@ labels = [
     Label(  'license plate'        , -1 ,       19 , 'vehicle'         , 7       , False        , True         , (  0,  0,142) ),
 ]
 
-# create a function which maps id to trainId:
+# create a lookup table which maps id to trainId:
 id_to_trainId = {label.id: label.trainId for label in labels}
-id_to_trainId_map_func = np.vectorize(id_to_trainId.get)
+id_to_trainId_lut = np.full((256, ), 19, dtype=np.uint8) # (unknown ids are mapped to 19 (void))
+for id, trainId in id_to_trainId.items():
+    if id >= 0:
+        id_to_trainId_lut[id] = trainId
 
 synscapes_path = "./data/synscapes"
 synscapes_meta_path = "./data/synscapes_meta"
 
-if not os.path.exists(synscapes_meta_path):
-    os.makedirs(synscapes_meta_path)
-if not os.path.exists(synscapes_meta_path + "/gtFine"):
-    os.makedirs(synscapes_meta_path + "/gtFine")
-if not os.path.exists(synscapes_meta_path + "/label_imgs"):
-    os.makedirs(synscapes_meta_path + "/label_imgs")
+num_workers = os.cpu_count()
 
 img_h = 720
 img_w = 1440
@@ -105,108 +104,122 @@ img_w = 1440
 new_img_h = 1024
 new_img_w = 2048
 
-################################################################################
-# randomly select a subset of 2975 images as train and 500 images as val:
-################################################################################
-img_ids_float = np.linspace(1, 25000, 25000)
-img_ids = []
-for img_id_float in img_ids_float:
-    img_id_str = str(int(img_id_float))
-    img_ids.append(img_id_str)
-
-random.shuffle(img_ids)
-random.shuffle(img_ids)
-random.shuffle(img_ids)
-random.shuffle(img_ids)
-
-train_img_ids = img_ids[0:2975]
-print ("num train images: %d" % len(train_img_ids))
-with open(synscapes_meta_path + "/train_img_ids.pkl", "wb") as file:
-    pickle.dump(train_img_ids, file)
-
-val_img_ids = img_ids[2975:(2975+500)]
-print ("num val images: %d" % len(val_img_ids))
-with open(synscapes_meta_path + "/val_img_ids.pkl", "wb") as file:
-    pickle.dump(val_img_ids, file)
-
-################################################################################
-# enlarge all train labels and save to disk:
-################################################################################
-label_dir = synscapes_path + "/img/class/"
-for (step, img_id) in enumerate(train_img_ids):
-    if (step % 100) == 0:
-        print ("enlarging train labels, step: %d/%d" % (step+1, len(train_img_ids)))
-
-    gtFine_img_path = label_dir + img_id + ".png"
-    gtFine_img = cv2.imread(gtFine_img_path, -1) # (shape: (720, 1440))
-
-    # resize gtFine_img without interpolation:
-    gtFine_img = cv2.resize(gtFine_img, (new_img_w, new_img_h), interpolation=cv2.INTER_NEAREST) # (shape: (1024, 2048))
-
-    cv2.imwrite(synscapes_meta_path + "/gtFine/" + img_id + ".png", gtFine_img)
-
-    # convert gtFine_img from id to trainId pixel values:
-    label_img = id_to_trainId_map_func(gtFine_img) # (shape: (1024, 2048))
-    label_img = label_img.astype(np.uint8)
-
-    cv2.imwrite(synscapes_meta_path + "/label_imgs/" + img_id + ".png", label_img)
-
-################################################################################
-# enlarge all val labels and save to disk:
-################################################################################
-label_dir = synscapes_path + "/img/class/"
-for (step, img_id) in enumerate(val_img_ids):
-    if (step % 100) == 0:
-        print ("enlarging val labels, step: %d/%d" % (step+1, len(val_img_ids)))
-
-    gtFine_img_path = label_dir + img_id + ".png"
-    gtFine_img = cv2.imread(gtFine_img_path, -1) # (shape: (720, 1440))
-
-    # resize gtFine_img without interpolation:
-    gtFine_img = cv2.resize(gtFine_img, (new_img_w, new_img_h), interpolation=cv2.INTER_NEAREST) # (shape: (1024, 2048))
-
-    cv2.imwrite(synscapes_meta_path + "/gtFine/" + img_id + ".png", gtFine_img)
-
-    # convert gtFine_img from id to trainId pixel values:
-    label_img = id_to_trainId_map_func(gtFine_img) # (shape: (1024, 2048))
-    label_img = label_img.astype(np.uint8)
-
-    cv2.imwrite(synscapes_meta_path + "/label_imgs/" + img_id + ".png", label_img)
-
-################################################################################
-# compute the class weigths:
-################################################################################
 num_classes = 19
 
-trainId_to_count = {}
-for trainId in range(num_classes):
-    trainId_to_count[trainId] = 0
-
-# get the total number of pixels in all train label_imgs that are of each object class:
-for step, img_id in enumerate(train_img_ids):
-    if (step % 100) == 0:
-        print ("computing class weights, step: %d/%d" % (step+1, len(train_img_ids)))
-
+def enlarge_label(img_id):
+    # (enlarges the label of img_id, saves it with ids and trainIds and returns
+    # the per-class pixel counts. Outputs that already exist are not recomputed)
+    gtFine_path = synscapes_meta_path + "/gtFine/" + img_id + ".png"
     label_img_path = synscapes_meta_path + "/label_imgs/" + img_id + ".png"
-    label_img = cv2.imread(label_img_path, -1)
-
-    for trainId in range(num_classes):
-        # count how many pixels in label_img which are of object class trainId:
-        trainId_mask = np.equal(label_img, trainId)
-        trainId_count = np.sum(trainId_mask)
-
-        # add to the total count:
-        trainId_to_count[trainId] += trainId_count
-
-# compute the class weights according to the ENet paper:
-class_weights = []
-total_count = sum(trainId_to_count.values())
-for trainId, count in trainId_to_count.items():
-    trainId_prob = float(count)/float(total_count)
-    trainId_weight = 1/np.log(1.02 + trainId_prob)
-    class_weights.append(trainId_weight)
-
-print (class_weights)
 
-with open(synscapes_meta_path + "/class_weights.pkl", "wb") as file:
-    pickle.dump(class_weights, file, protocol=2) # (protocol=2 is needed to be able to open this file with python2)
+    label_img = None
+    if os.path.exists(gtFine_path) and os.path.exists(label_img_path):
+        label_img = cv2.imread(label_img_path, -1)
+
+    if label_img is None:
+        gtFine_img_path = synscapes_path + "/img/class/" + img_id + ".png"
+        gtFine_img = cv2.imread(gtFine_img_path, -1) # (shape: (720, 1440))
+        if gtFine_img is None:
+            print ("could not read %s, skipping" % gtFine_img_path)
+            return img_id, None
+
+        # resize gtFine_img without interpolation:
+        gtFine_img = cv2.resize(gtFine_img, (new_img_w, new_img_h), interpolation=cv2.INTER_NEAREST) # (shape: (1024, 2048))
+
+        # convert gtFine_img from id to trainId pixel values:
+        label_img = cv2.LUT(gtFine_img.astype(np.uint8), id_to_trainId_lut) # (shape: (1024, 2048))
+
+        # (write to temporary files first, so that a partially written file is never skipped on resume:)
+        cv2.imwrite(gtFine_path + ".tmp.png", gtFine_img)
+        cv2.imwrite(label_img_path + ".tmp.png", label_img)
+        os.replace(gtFine_path + ".tmp.png", gtFine_path)
+        os.replace(label_img_path + ".tmp.png", label_img_path)
+
+    # count how many pixels in label_img are of each object class:
+    trainId_count = np.bincount(label_img.ravel(), minlength=256)[0:num_classes]
+
+    return img_id, trainId_count
+
+def enlarge_labels(img_ids, name, pool):
+    trainId_counts = {}
+    for step, (img_id, trainId_count) in enumerate(pool.imap_unordered(enlarge_label, img_ids, chunksize=8)):
+        if (step % 100) == 0:
+            print ("enlarging %s labels, step: %d/%d" % (name, step+1, len(img_ids)))
+        trainId_counts[img_id] = trainId_count
+    return trainId_counts
+
+if __name__ == "__main__":
+    cv2.setNumThreads(1) # (parallelism comes from the process pool)
+
+    if not os.path.exists(synscapes_meta_path):
+        os.makedirs(synscapes_meta_path)
+    if not os.path.exists(synscapes_meta_path + "/gtFine"):
+        os.makedirs(synscapes_meta_path + "/gtFine")
+    if not os.path.exists(synscapes_meta_path + "/label_imgs"):
+        os.makedirs(synscapes_meta_path + "/label_imgs")
+
+    ################################################################################
+    # randomly select a subset of 2975 images as train and 500 images as val:
+    ################################################################################
+    if os.path.exists(synscapes_meta_path + "/train_img_ids.pkl") and os.path.exists(synscapes_meta_path + "/val_img_ids.pkl"):
+        # (resume with the existing split:)
+        with open(synscapes_meta_path + "/train_img_ids.pkl", "rb") as file:
+            train_img_ids = pickle.load(file)
+        with open(synscapes_meta_path + "/val_img_ids.pkl", "rb") as file:
+            val_img_ids = pickle.load(file)
+        print ("num train images: %d (existing split)" % len(train_img_ids))
+        print ("num val images: %d (existing split)" % len(val_img_ids))
+    else:
+        img_ids_float = np.linspace(1, 25000, 25000)
+        img_ids = []
+        for img_id_float in img_ids_float:
+            img_id_str = str(int(img_id_float))
+            img_ids.append(img_id_str)
+
+        random.shuffle(img_ids)
+        random.shuffle(img_ids)
+        random.shuffle(img_ids)
+        random.shuffle(img_ids)
+
+        train_img_ids = img_ids[0:2975]
+        print ("num train images: %d" % len(train_img_ids))
+        with open(synscapes_meta_path + "/train_img_ids.pkl", "wb") as file:
+            pickle.dump(train_img_ids, file)
+
+        val_img_ids = img_ids[2975:(2975+500)]
+        print ("num val images: %d" % len(val_img_ids))
+        with open(synscapes_meta_path + "/val_img_ids.pkl", "wb") as file:
+            pickle.dump(val_img_ids, file)
+
+    pool = Pool(num_workers)
+
+    ################################################################################
+    # enlarge all train and val labels and save to disk:
+    ################################################################################
+    train_trainId_counts = enlarge_labels(train_img_ids, "train", pool)
+    enlarge_labels(val_img_ids, "val", pool)
+
+    pool.close()
+    pool.join()
+
+    ################################################################################
+    # compute the class weigths:
+    ################################################################################
+    # get the total number of pixels in all train label_imgs that are of each object class:
+    trainId_to_count = np.zeros((num_classes, ), dtype=np.int64)
+    for img_id in train_img_ids:
+        if train_trainId_counts[img_id] is not None:
+            trainId_to_count += train_trainId_counts[img_id]
+
+    # compute the class weights according to the ENet paper:
+    class_weights = []
+    total_count = trainId_to_count.sum()
+    for trainId, count in enumerate(trainId_to_count):
+        trainId_prob = float(count)/float(total_count)
+        trainId_weight = 1/np.log(1.02 + trainId_prob)
+        class_weights.append(trainId_weight)
+
+    print (class_weights)
+
+    with open(synscapes_meta_path + "/class_weights.pkl", "wb") as file:
+        pickle.dump(class_weights, file, protocol=2) # (protocol=2 is needed to be able to open this file with python2)
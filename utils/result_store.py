@@ -0,0 +1,203 @@
+# code-checked
+# server-checked
+
+# Store of the per-pixel results of an evaluation (mean probabilities,
+# entropy/MI maps, ...) with random access to any image or region:
+#   path/data.bin (the compressed chunks of all arrays, appended)
+#   path/index.pkl (per image and array: shape, encoding and the (offset, length) of each chunk)
+# Each array of shape (..., h, w) is split into chunks of chunk_size x chunk_size
+# pixels (with all leading dims, e.g. all classes of p). The values are stored
+# as float16 or quantized to uint8 (see default_encodings), byte-shuffled and
+# zlib compressed. ResultStore memory-maps data.bin and only decompresses the
+# chunks of the requested region. Writing an image again replaces its entry
+# (its old chunks stay in data.bin until the store is deleted). The index is
+# saved every flush_every images, so that the images written before a crash
+# stay readable.
+#
+# (usage: ResultWriter/ResultStoreSink to write, ResultStore(path).read(name, "entropy", region) to read)
+
+import os
+import zlib
+import pickle
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+# (array name -> (dtype, scale): uint8 values are round(value/scale), other arrays are float16)
+default_encodings = {"p": ("uint8", 1.0/255), "label": ("uint8", 1.0)}
+
+def encode(values, dtype, scale):
+    """
+    :param values: array or tensor (e.g. on the GPU, to copy the encoded values only)
+    """
+    if isinstance(values, torch.Tensor):
+        if dtype == "uint8":
+            return torch.clamp(torch.round(values/scale), 0, 255).to(torch.uint8).cpu().numpy()
+        return values.half().cpu().numpy()
+    if dtype == "uint8":
+        return np.clip(np.rint(values/scale), 0, 255).astype(np.uint8)
+    return values.astype(np.float16)
+
+def encode_chunk(chunk, compression_level):
+    data = np.ascontiguousarray(chunk)
+    if data.dtype.itemsize > 1:
+        # (byte shuffle, the high bytes of neighboring values compress well:)
+        data = np.ascontiguousarray(data.view(np.uint8).reshape(-1, data.dtype.itemsize).T)
+    return zlib.compress(data.tobytes(), compression_level)
+
+def decode_chunk(data, dtype, shape):
+    data = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+    if dtype.itemsize > 1:
+        data = np.ascontiguousarray(data.reshape(dtype.itemsize, -1).T)
+    return data.view(dtype).reshape(shape)
+
+class ResultWriter(object):
+    """
+    Appends the arrays of each image to the store at path (created if needed).
+    :param encodings: array name -> (dtype, scale), see default_encodings
+    :param flush_every: save the index after every flush_every images (and in close())
+    """
+    def __init__(self, path, chunk_size=256, compression_level=1, encodings=default_encodings, num_threads=4, flush_every=16):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.compression_level = compression_level
+        self.encodings = encodings
+        self.flush_every = flush_every
+        self.num_unflushed = 0
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.index = collections.OrderedDict()
+        if os.path.exists(path + "/index.pkl"):
+            with open(path + "/index.pkl", "rb") as file:
+                self.index = pickle.load(file)
+        self.file = open(path + "/data.bin", "ab")
+        self.offset = self.file.tell()
+        self.executor = ThreadPoolExecutor(num_threads) # (zlib releases the GIL)
+
+    def write(self, name, arrays):
+        """
+        :param arrays: dict of array name -> array of shape (..., h, w) (e.g. {"p": (num_classes, h, w), "entropy": (h, w)}),
+                       arrays of the stored dtype are stored as they are (see encode())
+        """
+        entries = {}
+        for array_name, array in arrays.items():
+            dtype, scale = self.encodings.get(array_name, ("float16", None))
+            array = np.asarray(array)
+            if array.dtype != np.dtype(dtype):
+                array = encode(array, dtype, scale)
+
+            h, w = array.shape[-2:]
+            chunk_slices = [(slice(y, y + self.chunk_size), slice(x, x + self.chunk_size))
+                            for y in range(0, h, self.chunk_size) for x in range(0, w, self.chunk_size)]
+            chunks = self.executor.map(lambda s: encode_chunk(array[..., s[0], s[1]], self.compression_level), chunk_slices)
+
+            offsets = np.zeros((len(chunk_slices), 2), dtype=np.int64) # (offset, length of each chunk in data.bin)
+            for i, chunk in enumerate(chunks):
+                self.file.write(chunk)
+                offsets[i] = (self.offset, len(chunk))
+                self.offset += len(chunk)
+            entries[array_name] = {"shape": array.shape, "dtype": dtype, "scale": scale, "chunk_size": self.chunk_size,
+                                   "chunks": offsets.reshape(-(-h//self.chunk_size), -(-w//self.chunk_size), 2)}
+        self.index[name] = entries
+        self.num_unflushed += 1
+        if self.num_unflushed >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        # (the index is replaced atomically, after its data has been written)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.num_unflushed = 0
+        with open(self.path + "/index.pkl.tmp", "wb") as file:
+            pickle.dump(self.index, file)
+        os.replace(self.path + "/index.pkl.tmp", self.path + "/index.pkl")
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        self.executor.shutdown()
+
+class ResultStore(object):
+    """
+    Read access to a store written by ResultWriter.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path + "/index.pkl", "rb") as file:
+            self.index = pickle.load(file)
+        self.data = None
+        if os.path.getsize(path + "/data.bin") > 0:
+            self.data = np.memmap(path + "/data.bin", dtype=np.uint8, mode="r")
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def names(self):
+        return list(self.index.keys())
+
+    def arrays(self, name):
+        return list(self.index[name].keys())
+
+    def shape(self, name, array_name):
+        return self.index[name][array_name]["shape"]
+
+    def read(self, name, array_name, region=None, raw=False):
+        """
+        :param region: (y0, y1, x0, x1) (None: the whole array)
+        :param raw: return the stored values (uint8/float16) instead of float32 values
+        :return: array of shape (..., y1-y0, x1-x0)
+        """
+        entry = self.index[name][array_name]
+        shape = entry["shape"]
+        h, w = shape[-2:]
+        y0, y1, x0, x1 = (0, h, 0, w) if region is None else region
+        if not (0 <= y0 < y1 <= h and 0 <= x0 < x1 <= w):
+            raise Exception("region %s is outside of the array of shape %s!" % (region, shape))
+
+        dtype = np.dtype(entry["dtype"])
+        size = entry["chunk_size"]
+        values = np.empty(shape[:-2] + (y1 - y0, x1 - x0), dtype=dtype)
+        for cy in range(y0//size, (y1 - 1)//size + 1):
+            for cx in range(x0//size, (x1 - 1)//size + 1):
+                offset, length = entry["chunks"][cy, cx]
+                chunk_shape = shape[:-2] + (min(size, h - cy*size), min(size, w - cx*size))
+                chunk = decode_chunk(self.data[offset:(offset + length)], dtype, chunk_shape)
+                # (the overlap of the chunk and the region, in image coordinates:)
+                oy0, oy1 = max(y0, cy*size), min(y1, (cy + 1)*size)
+                ox0, ox1 = max(x0, cx*size), min(x1, (cx + 1)*size)
+                values[..., (oy0 - y0):(oy1 - y0), (ox0 - x0):(ox1 - x0)] = chunk[..., (oy0 - cy*size):(oy1 - cy*size), (ox0 - cx*size):(ox1 - cx*size)]
+
+        if raw:
+            return values
+        values = values.astype(np.float32)
+        if entry["scale"] is not None:
+            values *= entry["scale"]
+        return values
+
+class ResultStoreSink(object):
+    """
+    UncertaintyEngine sink (see utils/inference.py) that writes the given
+    outputs of each image (without padding) to a ResultWriter.
+    """
+    def __init__(self, writer, outputs=("p", "entropy")):
+        self.writer = writer
+        self.outputs = list(outputs)
+
+    def update(self, images, labels, valid_sizes, names, results):
+        arrays = {}
+        for output in self.outputs:
+            dtype, scale = self.writer.encodings.get(output, ("float16", None))
+            arrays[output] = encode(results[output], dtype, scale)
+        for i in range(images.shape[0]):
+            h, w = images.shape[2:4] if valid_sizes is None else valid_sizes[i].tolist()
+            self.writer.write(names[i], {output: arrays[output][i, ..., 0:h, 0:w] for output in self.outputs})
+
+    def close(self):
+        self.writer.close()
+        return self.writer.path
@@ -0,0 +1,125 @@
+# code-checked
+# server-checked
+
+# (usage, from the repository root: python -m utils.tar_shards)
+#
+# Packs the examples of a dataset into sequentially readable tar shards:
+#   output_path/shard_00000.tar, shard_00001.tar, ...
+# Each example is stored as three consecutive members with the same key:
+#   <key>.img.png    (the encoded image file, as is)
+#   <key>.label.png  (the encoded label file, as is)
+#   <key>.json       ({"name": ..., "label_is_trainId": ...})
+
+import os
+import io
+import json
+import glob
+import pickle
+import random
+import tarfile
+
+def list_shards(shards_path):
+    if os.path.isdir(shards_path):
+        return sorted(glob.glob(shards_path + "/shard_*.tar"))
+    return sorted(glob.glob(shards_path))
+
+def _add_member(tar, member_name, member_bytes):
+    info = tarfile.TarInfo(member_name)
+    info.size = len(member_bytes)
+    tar.addfile(info, io.BytesIO(member_bytes))
+
+def write_shards(files, output_path, examples_per_shard=256, shuffle=True):
+    """
+    :param files: the files of one of the dataset classes in datasets.py (dicts
+                  with "img", "label", "name" and optionally "label_is_trainId")
+    :param shuffle: shuffle the examples (with a fixed seed) before writing them,
+                    so that each shard holds a mix of e.g. all Cityscapes cities
+    """
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    if shuffle:
+        files = list(files)
+        random.Random(0).shuffle(files)
+
+    shard = 0
+    num_examples = 0
+    tar = None
+    for step, datafiles in enumerate(files):
+        if (step % 100) == 0:
+            print ("writing shards, step: %d/%d" % (step+1, len(files)))
+
+        if not (os.path.exists(datafiles["img"]) and os.path.exists(datafiles["label"])):
+            print ("missing %s or %s, skipping" % (datafiles["img"], datafiles["label"]))
+            continue
+
+        if tar is None or num_examples == examples_per_shard:
+            if tar is not None:
+                tar.close()
+                shard += 1
+            tar = tarfile.open(output_path + "/shard_%05d.tar" % shard, "w")
+            num_examples = 0
+
+        key = "%08d" % step
+        with open(datafiles["img"], "rb") as file:
+            _add_member(tar, key + ".img" + os.path.splitext(datafiles["img"])[1], file.read())
+        with open(datafiles["label"], "rb") as file:
+            _add_member(tar, key + ".label" + os.path.splitext(datafiles["label"])[1], file.read())
+        meta = {"name": datafiles["name"], "label_is_trainId": bool(datafiles.get("label_is_trainId", False))}
+        _add_member(tar, key + ".json", json.dumps(meta).encode("utf-8"))
+        num_examples += 1
+
+    if tar is not None:
+        tar.close()
+        print ("wrote %d shard(s): %s" % (shard+1, output_path))
+
+def read_shard(shard_path):
+    """
+    Streams the examples of a shard (a single sequential read of the file).
+    :return: generator of dicts with "img" (bytes), "label" (bytes), "name", "label_is_trainId"
+    """
+    example = {}
+    key = None
+    with tarfile.open(shard_path, "r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            member_key, member_type = member.name.split(".")[0:2]
+            if member_key != key:
+                if len(example) == 4:
+                    yield example
+                example = {}
+                key = member_key
+            member_bytes = tar.extractfile(member).read()
+            if member_type == "json":
+                example.update(json.loads(member_bytes.decode("utf-8")))
+            else:
+                example[member_type] = member_bytes
+    if len(example) == 4:
+        yield example
+
+if __name__ == "__main__":
+    from datasets import DatasetCityscapesEval, get_label_file
+
+    cityscapes_path = "./data/cityscapes"
+    synscapes_path = "./data/synscapes"
+    synscapes_meta_path = "./data/synscapes_meta"
+
+    for split in ["train", "val"]:
+        if os.path.exists(cityscapes_path):
+            dataset = DatasetCityscapesEval(root=cityscapes_path, list_path="./lists/cityscapes/%s.lst" % split)
+            write_shards(dataset.files, cityscapes_path + "/shards/%s" % split)
+
+        if os.path.exists(synscapes_path):
+            with open("./lists/synscapes/%s_img_ids.pkl" % split, "rb") as file:
+                img_ids = pickle.load(file)
+            files = []
+            for img_id in img_ids:
+                label_file, label_is_trainId = get_label_file(synscapes_meta_path + "/gtFine/" + img_id + ".png")
+                files.append({
+                    "img": synscapes_path + "/img/rgb-2k/" + img_id + ".png",
+                    "label": label_file,
+                    "label_is_trainId": label_is_trainId,
+                    "name": img_id
+                })
+            write_shards(files, synscapes_meta_path + "/shards/%s" % split)
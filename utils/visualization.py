@@ -0,0 +1,90 @@
+# code-checked
+# server-checked
+
+import numpy as np
+import cv2
+
+# (RGB color of each trainId, all other values (incl. 255) are black)
+label_colors = [[128, 64, 128], [244, 35, 232], [70, 70, 70], [102, 102, 156], [190, 153, 153],
+                [153, 153, 153], [250, 170, 30], [220, 220, 0], [107, 142, 35], [152, 251, 152],
+                [70, 130, 180], [220, 20, 60], [255, 0, 0], [0, 0, 142], [0, 0, 70],
+                [0, 60, 100], [0, 80, 100], [0, 0, 230], [119, 11, 32]]
+
+color_lut = np.zeros((256, 3), dtype=np.uint8) # (shape: (256, 3), RGB)
+color_lut[0:len(label_colors)] = np.array(label_colors, dtype=np.uint8)
+color_lut_bgr = np.ascontiguousarray(color_lut[:, ::-1]) # (shape: (256, 3), BGR)
+
+mean = np.array([102.9801, 115.9465, 122.7717], dtype=np.float32)
+
+_colormap_luts = {}
+
+def colormap_lut(colormap):
+    """
+    Returns the (256, 3) BGR lookup table of the cv2 colormap, computed once.
+    """
+    if colormap not in _colormap_luts:
+        values = np.arange(256, dtype=np.uint8).reshape(256, 1)
+        _colormap_luts[colormap] = cv2.applyColorMap(values, colormap).reshape(256, 3)
+    return _colormap_luts[colormap]
+
+def _apply_lut(values, lut):
+    # (cv2.LUT maps each channel through the matching LUT channel, so replicate
+    # the uint8 values to 3 channels, with the batch stacked along the rows)
+    shape = values.shape
+    values = np.ascontiguousarray(values).reshape(-1, shape[-1])
+    colors = cv2.LUT(cv2.merge([values, values, values]), lut.reshape(1, 256, 3))
+    return colors.reshape(shape + (3,))
+
+def label_imgs_2_color(label_imgs, bgr=False):
+    """
+    Colorizes a batch of label images with a single table lookup.
+    :param label_imgs: uint8 array of shape (..., h, w)
+    :param bgr: return BGR (for cv2.imwrite) instead of RGB
+    :return: uint8 array of shape (..., h, w, 3)
+    """
+    label_imgs = np.asarray(label_imgs).astype(np.uint8, copy=False)
+    if bgr:
+        return _apply_lut(label_imgs, color_lut_bgr)
+    return _apply_lut(label_imgs, color_lut)
+
+def images_2_bgr(images):
+    """
+    Undoes the dataset normalization of a batch of images.
+    :param images: float array of shape (batch_size, 3, h, w) (RGB, mean subtracted)
+    :return: uint8 array of shape (batch_size, h, w, 3) (BGR)
+    """
+    images = np.asarray(images, dtype=np.float32)
+    batch_size, _, h, w = images.shape
+    imgs = np.empty((batch_size, h, w, 3), dtype=np.uint8)
+    for i in range(batch_size):
+        # (add the mean back with saturating rounding to uint8, then RGB -> BGR:)
+        channels = [cv2.add(images[i, c], float(mean[c]), dtype=cv2.CV_8U) for c in (2, 1, 0)]
+        cv2.merge(channels, dst=imgs[i])
+    return imgs
+
+def overlay(imgs, color_imgs, alpha=0.70):
+    """
+    Blends (1-alpha)*imgs + alpha*color_imgs in uint8 for a whole batch.
+    :param imgs: uint8 array of shape (..., h, w, 3)
+    :param color_imgs: uint8 array of the same shape
+    :return: uint8 array of the same shape
+    """
+    imgs = np.ascontiguousarray(imgs)
+    color_imgs = np.ascontiguousarray(color_imgs)
+    shape = imgs.shape
+    # (cv2 works on 2D images, so stack the batch along the rows:)
+    imgs = imgs.reshape(-1, shape[-2], shape[-1])
+    color_imgs = color_imgs.reshape(-1, shape[-2], shape[-1])
+    overlayed_imgs = cv2.addWeighted(imgs, 1.0 - alpha, color_imgs, alpha, 0.0)
+    return overlayed_imgs.reshape(shape)
+
+def values_2_color(values, colormap, max_value=1.0):
+    """
+    Maps a batch of values in [0, max_value] (e.g. entropy) to colors of a cv2 colormap.
+    :param values: float array of shape (..., h, w)
+    :return: uint8 array of shape (..., h, w, 3) (BGR)
+    """
+    values = np.asarray(values)/max_value
+    values *= 255
+    np.clip(values, 0, 255, out=values)
+    return _apply_lut(values.astype(np.uint8), colormap_lut(colormap))
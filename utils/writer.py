@@ -0,0 +1,109 @@
+# code-checked
+# server-checked
+
+import os
+import threading
+import queue
+
+import cv2
+
+# (all per-image outputs written by the eval scripts, saved as output_path/<name>_<type>.png)
+OUTPUT_TYPES = ["img", "label_overlayed", "pred_overlayed", "entropy", "hentropy"]
+
+class ImageWriter(object):
+    """
+    Writes per-image visualization outputs to disk from a pool of worker
+    threads, so that PNG encoding and disk writes overlap with inference of
+    the next batch (cv2.imwrite releases the GIL while encoding).
+
+    :param output_path: directory the images are written to
+    :param outputs: the output types to write (None: all of OUTPUT_TYPES)
+    :param num_workers: number of writer threads
+    :param max_queue_size: max number of pending images, write() blocks when full
+    """
+    def __init__(self, output_path, outputs=None, num_workers=4, max_queue_size=32):
+        self.output_path = output_path
+        if outputs is None:
+            outputs = OUTPUT_TYPES
+        for output_type in outputs:
+            if output_type not in OUTPUT_TYPES:
+                raise Exception("unknown output type '%s', must be one of %s!" % (output_type, OUTPUT_TYPES))
+        self.outputs = set(outputs)
+
+        if not os.path.exists(self.output_path):
+            os.makedirs(self.output_path)
+
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.errors = []
+        self.closed = False
+
+        self.workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._worker_loop, name="ImageWriter-%d" % i)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def enabled(self, output_type):
+        return output_type in self.outputs
+
+    def path(self, name, output_type):
+        return self.output_path + "/" + name + "_" + output_type + ".png"
+
+    def write(self, name, output_type, img):
+        """
+        Queues img for writing, blocks while max_queue_size images are pending.
+        Disabled output types are silently dropped.
+        """
+        if self.closed:
+            raise Exception("ImageWriter is closed!")
+        self._raise_errors()
+        if not self.enabled(output_type):
+            return
+        self.queue.put((self.path(name, output_type), img))
+
+    def flush(self):
+        """
+        Blocks until all queued images have been written to disk.
+        """
+        self.queue.join()
+        self._raise_errors()
+
+    def close(self):
+        """
+        Writes all queued images and stops the worker threads.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self._raise_errors()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _worker_loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                path, img = item
+                if not cv2.imwrite(path, img):
+                    raise IOError("could not write %s" % path)
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                self.queue.task_done()
+
+    def _raise_errors(self):
+        if len(self.errors) > 0:
+            error = self.errors[0]
+            self.errors = []
+            raise error